@@ -0,0 +1,57 @@
+"""
+Collision broadphase benchmark.
+
+Compares the brute force O(n²) collision pass with the spatial hash broadphase.
+Run from the repository root : python -m benchmarks.collisions
+"""
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import random
+import time
+
+from main import Game, Ball, Globals
+
+ACTOR_COUNTS = [10, 100, 1000]
+FRAMES = 30
+RADIUS = 30
+
+
+def populate(game: Game, n: int, seed: int = 0) -> None:
+    random.seed(seed)
+    game._actors.clear()
+    for _ in range(n):
+        ball = Ball(random.uniform(0, game.width), random.uniform(0, game.height)) \
+            .set_radius(RADIUS) \
+            .set_solid(True)
+        game.new_actor(ball)
+
+
+def run(game: Game, use_broadphase: bool, frames: int = FRAMES):
+    game.use_broadphase = use_broadphase
+    dt = 1/game.fps
+    tests = 0
+    start = time.perf_counter()
+    for _ in range(frames):
+        game.do_collisions(dt)
+        tests += game.collision_tests
+    elapsed = time.perf_counter() - start
+    return tests / frames, elapsed * 1000 / frames
+
+
+def main() -> None:
+    game = Globals.game or Game("Collision benchmark", 1280, 768)
+    
+    print(f"{'actors':>8} {'mode':>12} {'pairs/frame':>12} {'ms/frame':>10}")
+    for n in ACTOR_COUNTS:
+        populate(game, n)
+        for use_broadphase in (False, True):
+            pairs, ms = run(game, use_broadphase)
+            mode = "spatialhash" if use_broadphase else "brute"
+            print(f"{n:>8} {mode:>12} {pairs:>12.0f} {ms:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Particle drawing benchmark.
+
+Compares blitting particles with a set_alpha call per particle against
+pre-baked alpha variants of the particle sprite, and reports the memory
+the variants cost. Each variant count is also checked to render the same
+pixels as set_alpha, for alphas that fall exactly on a baked level.
+Run from the repository root : python -m benchmarks.particles
+"""
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import time
+
+import numpy as np
+import pygame
+
+from engine.slimyengine import Game, Globals, ParticleEmitter, ParticleSystem, vec3
+
+PARTICLE_COUNTS = [1000, 10000]
+ALPHA_LEVELS = [0, 4, 16, 64]
+FRAMES = 20
+PIXEL_TOLERANCE = 8     # Rounding differences of the two blends, summed over overlapping particles
+
+
+def setup(n: int):
+    game = Globals.game or Game((1280, 720)).init().set_debug(False)
+    system = ParticleSystem(None, vec3())
+    emitter = ParticleEmitter(system, capacity=n)
+    emitter._sprite_size.x = emitter._sprite_size.y = 1
+    emitter.start()
+    
+    rng = np.random.default_rng(0)
+    velocities = np.zeros((n, 3))
+    emitter.spawn(velocities)
+    emitter._positions[:n, 0] = rng.uniform(-15, 15, n)
+    emitter._positions[:n, 1] = rng.uniform(-9, 9, n)
+    emitter.tick(0)
+    emitter._alphas[:n] = rng.integers(0, 256, n)
+    return game, emitter
+
+
+def run(game, emitter, levels: int) -> float:
+    emitter.alpha_levels = levels
+    emitter.draw()      # Bakes the variants outside of the timing
+    game.render_queue.flush(game.screen)
+    
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        emitter.draw()
+        game.render_queue.flush(game.screen)
+    return (time.perf_counter() - start) * 1000 / FRAMES
+
+
+def max_pixel_error(game, emitter, levels: int) -> int:
+    """
+    Largest per-channel difference between the set_alpha path and the variants path
+    """
+    n = emitter.count
+    alphas = emitter._alphas[:n].copy()
+    # Snap alphas to the baked levels, so both paths should blend identically
+    steps = (alphas.astype(np.int32)*(levels-1)+127)//255
+    emitter._alphas[:n] = np.round(steps*255/(levels-1))
+    
+    frames = []
+    for mode in (0, levels):
+        emitter.alpha_levels = mode
+        game.screen.fill((40, 80, 120))
+        emitter.draw()
+        game.render_queue.flush(game.screen)
+        frames.append(pygame.surfarray.array3d(game.screen).astype(np.int32))
+    emitter._alphas[:n] = alphas
+    return int(np.abs(frames[0]-frames[1]).max())
+
+
+def main() -> None:
+    print(f"{'particles':>10} {'levels':>9} {'ms/frame':>10} {'saved ms':>9} {'memory kB':>10} {'max error':>10}")
+    for n in PARTICLE_COUNTS:
+        game, emitter = setup(n)
+        baseline = None
+        for levels in ALPHA_LEVELS:
+            ms = run(game, emitter, levels)
+            if baseline is None:
+                baseline = ms
+            memory = emitter._alpha_variants.memory // 1024 if levels else 0
+            error = max_pixel_error(game, emitter, levels) if levels else 0
+            flag = " MISMATCH" if error > PIXEL_TOLERANCE else ""
+            print(f"{n:>10} {levels or 'set_alpha':>9} {ms:>10.3f} {baseline - ms:>9.3f} {memory:>10} {error:>10}{flag}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+End-to-end scenario benchmarks for the game loop.
+
+Builds reproducible scenarios on top of main.py and measures update, collision
+and draw time separately over N frames. Results are written as JSON.
+Run from the repository root : python -m benchmarks.scenarios [--frames N] [--output FILE]
+"""
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import argparse
+import json
+import random
+import sys
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from main import Game, Player, Ball, SphereCollision, Globals, Vec3
+from engine.profiler import profiler
+
+WIDTH, HEIGHT = 1280, 768
+PLAYER_RADIUS = 40
+BALL_RADIUS = 30
+
+
+def add_player(game: Game, x: float, y: float, team: int) -> Player:
+    player = Player(x, y) \
+        .set_collision(SphereCollision(PLAYER_RADIUS)) \
+        .set_solid(True)
+    player.typ = team
+    player.vel = Vec3(random.uniform(-200, 200), random.uniform(-200, 200), 0)
+    game.new_actor(player)
+    return player
+
+
+def add_ball(game: Game, x: float, y: float, radius: float = BALL_RADIUS) -> Ball:
+    ball = Ball(x, y) \
+        .set_radius(radius) \
+        .set_solid(True)
+    ball.vel = Vec3(random.uniform(-300, 300), random.uniform(-300, 300), 0)
+    game.new_actor(ball)
+    return ball
+
+
+def one_vs_one(game: Game) -> None:
+    add_player(game, WIDTH*0.25, HEIGHT/2, 0)
+    add_player(game, WIDTH*0.75, HEIGHT/2, 1)
+    add_ball(game, WIDTH/2, HEIGHT/2)
+
+
+def full_match(game: Game) -> None:
+    # 6 field players and a goalkeeper per team
+    for team, side in ((0, 0.0), (1, 1.0)):
+        add_player(game, abs(side - 0.05)*WIDTH, HEIGHT/2, team)
+        for i in range(6):
+            x = abs(side - (0.2 + 0.1*(i % 3)))*WIDTH
+            y = HEIGHT * (0.25 + 0.5*(i // 3))
+            add_player(game, x, y, team)
+    add_ball(game, WIDTH/2, HEIGHT/2)
+
+
+def stress_balls(n: int) -> Callable[[Game], None]:
+    def build(game: Game) -> None:
+        for _ in range(n):
+            add_ball(game, random.uniform(0, WIDTH), random.uniform(0, HEIGHT), 10)
+    return build
+
+
+SCENARIOS: Dict[str, Callable[[Game], None]] = {
+    "1v1": one_vs_one,
+    "7v7": full_match,
+    "stress_200_balls": stress_balls(200),
+    "stress_500_balls": stress_balls(500),
+}
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    ms = np.array(samples) * 1000
+    return {
+        "mean": float(ms.mean()),
+        "p50": float(np.percentile(ms, 50)),
+        "p95": float(np.percentile(ms, 95)),
+        "p99": float(np.percentile(ms, 99)),
+    }
+
+
+def run_scenario(game: Game, build: Callable[[Game], None], frames: int, seed: int = 0) -> dict:
+    random.seed(seed)
+    game._actors.clear()
+    game.frame = 0
+    build(game)
+    
+    # The collision pass is timed through its profiler scope, update time excludes it
+    was_enabled = profiler.enabled
+    profiler.enable()
+    
+    dt = game.timestep      # Same step as the windowed loop
+    update, collisions, draw, total = [], [], [], []
+    try:
+        for _ in range(frames):
+            t0 = time.perf_counter()
+            game.update(dt)
+            t1 = time.perf_counter()
+            game.draw(game.screen)
+            t2 = time.perf_counter()
+            profiler.end_frame()
+            
+            collision_time = profiler.last_frame.get("Game.do_collisions", 0.0) / 1000
+            collisions.append(collision_time)
+            update.append(t1 - t0 - collision_time)
+            draw.append(t2 - t1)
+            total.append(t2 - t0)
+    finally:
+        profiler.enable(was_enabled)
+        profiler.clear()
+    
+    return {
+        "frames": frames,
+        "actors": len(game._actors),
+        "update_ms": percentiles(update),
+        "collisions_ms": percentiles(collisions),
+        "draw_ms": percentiles(draw),
+        "frame_ms": percentiles(total),
+    }
+
+
+def main(argv: List[str]|None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=300, help="frames simulated per scenario")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="scenario to run (default: all)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file to write, stdout if omitted")
+    args = parser.parse_args(argv)
+    
+    game = Globals.game or Game("Scenario benchmark", WIDTH, HEIGHT)
+    
+    results = {}
+    for name in args.scenario or SCENARIOS:
+        results[name] = run_scenario(game, SCENARIOS[name], args.frames, args.seed)
+    
+    report = {
+        "python": sys.version.split()[0],
+        "frames": args.frames,
+        "seed": args.seed,
+        "scenarios": results,
+    }
+    
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import io
+import json
+import os
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Tuple
+
+import pygame
+
+
+class AssetEntry:
+    def __init__(self, kind:str, name:str, path:str, size=None) -> None:
+        self.kind = kind        # "image" or "font"
+        self.name = name
+        self.path = path
+        self.size = size        # (width, height) for images, point size for fonts
+
+
+class AssetManifest:
+    """
+    List of the images and fonts to preload.
+    JSON form: {"images": [{"name", "path", "size"?}], "fonts": [{"name", "path", "size"}]}
+    """
+    def __init__(self) -> None:
+        self.entries:List[AssetEntry] = []
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add_image(self, name:str, path:str, size:Tuple[int, int]|None=None) -> 'AssetManifest':
+        self.entries.append(AssetEntry("image", name, path, tuple(size) if size else None))
+        return self
+
+    def add_font(self, name:str, path:str, size:int=28) -> 'AssetManifest':
+        self.entries.append(AssetEntry("font", name, path, size))
+        return self
+
+    @staticmethod
+    def from_json(path:str) -> 'AssetManifest':
+        with open(path) as f:
+            data = json.load(f)
+        manifest = AssetManifest()
+        for image in data.get("images", []):
+            manifest.add_image(image["name"], image["path"], image.get("size"))
+        for font in data.get("fonts", []):
+            manifest.add_font(font["name"], font["path"], font.get("size", 28))
+        return manifest
+
+
+def _decode_image(path:str, size) -> pygame.Surface:
+    surface = pygame.image.load(path)
+    if size:
+        surface = pygame.transform.scale(surface, size)
+    return surface
+
+def _read_file(path:str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class AssetPreloader:
+    """
+    Decodes the assets of a manifest on a thread pool.
+    poll() must be called from the main thread: it finishes the ready assets there
+    (convert_alpha, font creation) and hands them to on_image/on_font.
+    """
+    def __init__(self, manifest:AssetManifest, workers:int|None=None, resolve:Callable[[str], str]|None=None) -> None:
+        self.manifest = manifest
+        self.images:Dict[str, pygame.Surface] = {}
+        self.fonts:Dict[str, pygame.font.Font] = {}
+        self.on_image:Callable[[AssetEntry, pygame.Surface], None]|None = None
+        self.on_font:Callable[[AssetEntry, pygame.font.Font], None]|None = None
+        self.loaded = 0
+        self._workers = workers if workers else min(8, os.cpu_count() or 1)
+        self._resolve = resolve if resolve else (lambda path: path)
+        self._executor:ThreadPoolExecutor|None = None
+        self._pending:Dict[Future, AssetEntry] = {}
+
+    @property
+    def total(self) -> int:
+        return len(self.manifest)
+
+    @property
+    def progress(self) -> float:
+        return self.loaded/self.total if self.total else 1.
+
+    @property
+    def done(self) -> bool:
+        return self.loaded>=self.total
+
+    def start(self) -> 'AssetPreloader':
+        self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="assets")
+        for entry in self.manifest.entries:
+            path = self._resolve(entry.path)
+            if entry.kind=="image":
+                future = self._executor.submit(_decode_image, path, entry.size)
+            else:
+                future = self._executor.submit(_read_file, path)
+            self._pending[future] = entry
+        return self
+
+    def _finish(self, future:Future, entry:AssetEntry) -> None:
+        result = future.result()    # Raises the worker exception, if any
+        if entry.kind=="image":
+            surface:pygame.Surface = result
+            if pygame.display.get_surface() is not None:
+                surface = surface.convert_alpha()
+            self.images[entry.name] = surface
+            if self.on_image: self.on_image(entry, surface)
+        else:
+            font = pygame.font.Font(io.BytesIO(result), entry.size)
+            self.fonts[entry.name] = font
+            if self.on_font: self.on_font(entry, font)
+        self.loaded += 1
+
+    def poll(self) -> List[AssetEntry]:
+        """
+        Finishes the assets decoded since the last call, without blocking
+        """
+        ready = [future for future in self._pending if future.done()]
+        entries = []
+        try:
+            for future in ready:
+                entry = self._pending.pop(future)
+                self._finish(future, entry)
+                entries.append(entry)
+        except BaseException:
+            self._shutdown()    # A failed asset stops the others
+            raise
+        if self.done: self._shutdown()
+        return entries
+
+    def wait(self) -> 'AssetPreloader':
+        """
+        Blocks until every asset is ready
+        """
+        try:
+            for future in as_completed(list(self._pending)):
+                entry = self._pending.pop(future)
+                self._finish(future, entry)
+        finally:
+            self._shutdown()
+        return self
+
+    def _shutdown(self) -> None:
+        if self._executor:
+            # Assets not started yet are dropped after a failure
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._pending.clear()
@@ -0,0 +1,118 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict
+
+
+class _NullScope:
+    """
+    Scope returned when profiling is disabled, does nothing
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+_NULL_SCOPE = _NullScope()
+
+
+class _Scope:
+    __slots__ = ("_profiler", "_name", "_start")
+
+    def __init__(self, profiler:'Profiler', name:str) -> None:
+        self._profiler = profiler
+        self._name = name
+        self._start = 0
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._profiler._record(self._name, self._start, time.perf_counter_ns())
+
+
+class Profiler:
+    """
+    Named scope profiler.
+    Scopes are timed with `with profiler.scope("name"):` or the `@profiler.profile()` decorator.
+    Per-frame totals are available in `last_frame` (milliseconds) after `end_frame()`,
+    and every recorded scope can be dumped as a Chrome about:tracing JSON file.
+    """
+    def __init__(self, max_events:int=100000) -> None:
+        self.enabled:bool = False
+        self.last_frame:Dict[str, float] = {}
+        self._frame:Dict[str, int] = {}
+        self._events:deque[tuple[str, int, int, int]] = deque(maxlen=max_events)   # name, start, duration, thread
+        self._origin:int = time.perf_counter_ns()
+
+    def enable(self, val:bool=True) -> 'Profiler':
+        self.enabled = val
+        return self
+
+    def clear(self) -> None:
+        self.last_frame = {}
+        self._frame = {}
+        self._events.clear()
+        self._origin = time.perf_counter_ns()
+
+    def scope(self, name:str):
+        if not self.enabled:
+            return _NULL_SCOPE
+        return _Scope(self, name)
+
+    def profile(self, name:str|None=None) -> Callable:
+        def decorator(fn:Callable) -> Callable:
+            scope_name = name if name else fn.__qualname__
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                start = time.perf_counter_ns()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self._record(scope_name, start, time.perf_counter_ns())
+            return wrapper
+        return decorator
+
+    def _record(self, name:str, start:int, end:int) -> None:
+        duration = end-start
+        self._frame[name] = self._frame.get(name, 0)+duration
+        self._events.append((name, start, duration, threading.get_ident()))
+
+    def end_frame(self) -> None:
+        """
+        Closes the current frame, its totals are moved to last_frame
+        """
+        if not self._frame:
+            if self.last_frame: self.last_frame = {}
+            return
+        self.last_frame = {name: duration*1E-6 for name, duration in self._frame.items()}
+        self._frame = {}
+
+    def dump_chrome_trace(self, path:str) -> None:
+        """
+        Writes the recorded scopes in the Chrome trace event format (about:tracing, Perfetto)
+        """
+        pid = os.getpid()
+        events = [{
+            "name": name,
+            "ph": "X",
+            "ts": (start-self._origin)/1000,
+            "dur": duration/1000,
+            "pid": pid,
+            "tid": tid,
+        } for name, start, duration, tid in self._events]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+profiler = Profiler()
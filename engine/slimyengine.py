@@ -4,14 +4,24 @@ import random
 import sys
 import time
 import colorit
+import hashlib
 from typing import List, Tuple, Union, Literal
-from collections import deque
+from collections import deque, OrderedDict
 import numpy as np
 import json
 from pathlib import Path
 
 import pygame
-from sortedcontainers import SortedList, SortedDict
+from sortedcontainers import SortedDict
+
+try:
+    from engine.profiler import profiler
+    from engine.text import text_renderer
+    from engine.assets import AssetManifest, AssetPreloader
+except ImportError:
+    from profiler import profiler
+    from text import text_renderer
+    from assets import AssetManifest, AssetPreloader
 
 vec2 = pygame.math.Vector2
 vec3 = pygame.math.Vector3
@@ -42,6 +52,18 @@ def random_vec3_in_cone(direction : vec3, angle : float) -> vec3:
     p2 = direction.cross(p1)
     return direction+v[0]*p1+v[1]*p2
 
+def random_vec3_in_cone_many(direction : vec3, angles : np.ndarray) -> np.ndarray:
+    """
+    Vectorized random_vec3_in_cone, one (N, 3) row per angle
+    """
+    n = len(angles)
+    side = np.arctan(angles)
+    a = (2*np.random.random(n)-1)*side
+    b = (2*np.random.random(n)-1)*side
+    p1 = perpendicular_vector(direction)
+    p2 = direction.cross(p1)
+    return np.array(direction)+a[:, None]*np.array(p1)+b[:, None]*np.array(p2)
+
 def random_vec2_in_cone(direction : vec2, angle : float) -> vec2:
     r, theta = direction.as_polar()
     v=vec2()
@@ -74,58 +96,49 @@ def color_from_vec3(vector:vec3) -> pygame.Color:
     return pygame.Color(int(vector.x), int(vector.y), int(vector.z))
 
 
-def generate_radial_gradient(color1:vec3, alpha1:int, color2:vec3, alpha2:int, size:vec2=vec2(512, 512)):
-    temp_surface = pygame.Surface(size, pygame.SRCALPHA)
-
-    # use this to set the amount of 'segments' we rotate our blend into
-    # this helps stop blends from looking 'boxy' or like a cross.
-    circular_smoothness_steps = 5
-
-    colour_1 = pygame.Color((int(color1.x), int(color1.y), int(color1.z), alpha1))
-    colour_1.r = colour_1.r//circular_smoothness_steps
-    colour_1.g = colour_1.g//circular_smoothness_steps
-    colour_1.b = colour_1.b//circular_smoothness_steps
-    colour_1.a = colour_1.a//circular_smoothness_steps
-
-    colour_2 = pygame.Color((int(color2.x), int(color2.y), int(color2.z), alpha2))
-    colour_2.r = colour_2.r//circular_smoothness_steps
-    colour_2.g = colour_2.g//circular_smoothness_steps
-    colour_2.b = colour_2.b//circular_smoothness_steps
-    colour_2.a = colour_2.a//circular_smoothness_steps
-
-
-    # 3x3 - starter
-    radial_grad_starter = pygame.Surface((3, 3), pygame.SRCALPHA)
-    radial_grad_starter.fill(colour_1)
-    radial_grad_starter.fill(colour_2, pygame.Rect(1, 1, 1, 1))
-
-    # 5x5 - starter
-    # radial_grad_starter = pygame.Surface((5, 5))
-    # radial_grad_starter.fill((0, 0, 0))
-    # radial_grad_starter.fill((255//circular_smoothness_steps,
-    #                           255//circular_smoothness_steps,
-    #                           255//circular_smoothness_steps), pygame.Rect(2, 1, 1, 3))
-    # radial_grad_starter.fill((255//circular_smoothness_steps,
-    #                           255//circular_smoothness_steps,
-    #                           255//circular_smoothness_steps), pygame.Rect(1, 2, 3, 1))
-
-
-    radial_grad = pygame.transform.smoothscale(radial_grad_starter, size)
+# Falloff curves of radial gradients: weight of the center color at normalized distance t (0 center, 1 edge)
+GRADIENT_FALLOFFS = {
+    "linear": lambda t: 1-t,
+    "quadratic": lambda t: (1-t)**2,
+    "smooth": lambda t: (1-t)**2*(1+2*t),
+    "inverse_square": lambda t: (1/(1+16*t**2)-1/17)*17/16,
+}
 
-    for i in range(0, circular_smoothness_steps):
-        radial_grad_rot = pygame.transform.rotate(radial_grad, (360.0/circular_smoothness_steps) * i)
+_radial_gradients:OrderedDict[tuple, pygame.Surface] = OrderedDict()
+RADIAL_GRADIENT_CACHE_SIZE = 32
 
-        pos_rect = pygame.Rect((0, 0), size)
-
-        area_rect = pygame.Rect(0, 0, size.x, size.y)
-        area_rect.center = radial_grad_rot.get_width()//2, radial_grad_rot.get_height()//2
-        temp_surface.blit(radial_grad_rot, pos_rect,
-                        area=area_rect,
-                        special_flags=pygame.BLEND_RGBA_ADD)
-
-    # final_pos_rect = pygame.Rect((0, 0), (512, 512))
-    # final_pos_rect.center = 400, 400
-    return temp_surface
+def generate_radial_gradient(color1:vec3, alpha1:int, color2:vec3, alpha2:int, size:vec2=vec2(512, 512), falloff:str="linear"):
+    """
+    Gradient from color2 at the center to color1 on the inscribed ellipse and beyond.
+    Surfaces are shared between identical calls, they must not be drawn on.
+    """
+    w, h = max(1, int(size[0])), max(1, int(size[1]))
+    key = (int(color1[0]), int(color1[1]), int(color1[2]), alpha1, int(color2[0]), int(color2[1]), int(color2[2]), alpha2, w, h, falloff)
+    surface = _radial_gradients.get(key)
+    if surface is not None:
+        _radial_gradients.move_to_end(key)
+        return surface
+    
+    x = (np.arange(w, dtype=np.float32)+.5-w/2)/(w/2)
+    y = (np.arange(h, dtype=np.float32)+.5-h/2)/(h/2)
+    t = np.sqrt(x[np.newaxis, :]**2 + y[:, np.newaxis]**2)
+    np.minimum(t, 1, out=t)
+    levels = (GRADIENT_FALLOFFS[falloff](t)*255+.5).astype(np.uint8)
+    
+    # RGBA of each of the 256 weight levels, packed in uint32 so a single take() colors every pixel
+    outer = np.array(key[0:4], dtype=np.float32)
+    inner = np.array(key[4:8], dtype=np.float32)
+    weights = np.linspace(0, 1, 256, dtype=np.float32)[:, np.newaxis]
+    lut = np.clip(outer + (inner-outer)*weights + .5, 0, 255).astype(np.uint8).view(np.uint32).ravel()
+    pixels = np.take(lut, levels)
+    surface = pygame.image.frombytes(pixels.tobytes(), (w, h), "RGBA")
+    if pygame.display.get_surface() is not None:
+        surface = surface.convert_alpha()
+    
+    _radial_gradients[key] = surface
+    if len(_radial_gradients)>RADIAL_GRADIENT_CACHE_SIZE:
+        _radial_gradients.popitem(last=False)
+    return surface
 
 
 def dt_to_seconds(dt:float) -> int:
@@ -162,6 +175,9 @@ class Timeline:
 
     def get(self, t:float):
         pass
+    
+    def get_many(self, t:np.ndarray) -> np.ndarray:
+        return np.array([self.get(x) for x in t], dtype=float)
 
 class FloatTimelineConstant(Timeline):
     def __init__(self, val:float) -> None:
@@ -170,6 +186,9 @@ class FloatTimelineConstant(Timeline):
     
     def get(self, t:float)->float:
         return self._val
+    
+    def get_many(self, t:np.ndarray) -> np.ndarray:
+        return np.full(t.shape, self._val, dtype=float)
 
 class FloatTimelineFadeIn(Timeline):
     def __init__(self, percentage:float) -> None:
@@ -180,6 +199,9 @@ class FloatTimelineFadeIn(Timeline):
         if t>self._percentage:
             return 1.
         return t/self._percentage
+    
+    def get_many(self, t:np.ndarray) -> np.ndarray:
+        return np.where(t>self._percentage, 1., t/self._percentage)
 
 class FloatTimelineFadeOut(Timeline):
     def __init__(self, percentage:float) -> None:
@@ -190,6 +212,9 @@ class FloatTimelineFadeOut(Timeline):
         if t<self._percentage:
             return 1.
         return 1-(t-self._percentage)/(1-self._percentage)
+    
+    def get_many(self, t:np.ndarray) -> np.ndarray:
+        return np.where(t<self._percentage, 1., 1-(t-self._percentage)/(1-self._percentage))
 
 class FloatTimelineFadeInOut(Timeline):
     def __init__(self, percentage:float) -> None:
@@ -203,6 +228,10 @@ class FloatTimelineFadeInOut(Timeline):
             return 1-(t-(1-self._percentage))/(self._percentage)
         else:
             return 1.
+    
+    def get_many(self, t:np.ndarray) -> np.ndarray:
+        return np.select([t<self._percentage, t>1-self._percentage],
+                         [t/self._percentage, 1-(t-(1-self._percentage))/(self._percentage)], 1.)
 
 class Colors:
     Color = pygame.Color
@@ -339,6 +368,13 @@ class Image:
         self._data = pygame.transform.scale(self._data, size)
         self.size = size
         return self
+    
+    def resized(self, size) -> 'Image':
+        """
+        Scaled copy, for consumers that must not change an image shared through the ImageCache
+        """
+        assert self._data!=None
+        return Image(self.name, size, self._path, pygame.transform.scale(self._data, size))
 
     
     @property
@@ -350,75 +386,163 @@ class Image:
         self._path = val
 
 class Tileset:
+    """
+    Tiles are areas of the single tileset image (the atlas), no pixel is copied.
+    get_tile returns images viewing the atlas through a subsurface.
+    """
     def __init__(self, name:str, path:str, tile_width:int, tile_height:int) -> None:
         self.global_image = Globals.game.load_image("tileset_"+name, path)
-        self._tiles:list[Image] = []
+        self._path = path
+        self._tiles:dict[int, Image] = {}       # Handles, created on demand
+        self._areas:list[pygame.Rect] = []
         self._name = name
         self._sx = int(tile_width)
         self._sy = int(tile_height)
         self._xr = int(self.global_image.size.x/float(tile_width))
         self._yr = int(self.global_image.size.y/float(tile_height))
         self._start_index:int = 1
+        bounds = self.global_image.get_data().get_rect()
         for y in range(0, int(self.global_image.size.y), self._sy):
             for x in range(0, int(self.global_image.size.x), self._sx):
-                im = Image("tileset_"+name+str(int(x))+"x"+str(int(y)), vec2(self._sx, self._sy), path)
-                im.get_data().blit(self.global_image.get_data(), vec2(0, 0), pygame.rect.Rect(x, y, self._sx, self._sy))
-                self._tiles.append(im)
+                self._areas.append(pygame.Rect(x, y, self._sx, self._sy).clip(bounds))
+    
+    def __len__(self) -> int:
+        return len(self._areas)
+    
+    @property
+    def atlas(self) -> pygame.Surface:
+        return self.global_image.get_data()
+    
+    def get_area(self, index:int) -> pygame.Rect:
+        return self._areas[index]
     
     def get_random_tile(self) -> Image:
-        return self._tiles[random.randrange(0, len(self._tiles))]
+        return self.get_tile(random.randrange(0, len(self._areas)))
 
     def get_tile(self, index:int) -> Image:
-        return self._tiles[index]
+        n = len(self._areas)
+        if not -n<=index<n:
+            raise RuntimeError("Tile does not exist")
+        index %= n      # Negative indices count from the end, one cached handle per tile
+        area = self._areas[index]
+        tile = self._tiles.get(index)
+        if tile is None:
+            tile = self._tiles[index] = self._make_handle(area)
+        return tile
+    
+    def _make_handle(self, area:pygame.Rect) -> Image:
+        return Image("tileset_"+self._name+str(area.x)+"x"+str(area.y), vec2(area.width, area.height), self._path, self.atlas.subsurface(area))
     
     def get_tile_component(self, i:int) -> 'SpriteComponent':
         sc = SpriteComponent(None, vec3(), vec2(self._sx, self._sy))
-        sc.sprite = self._tiles[i]
+        # Own handle, the component may resize it
+        sc.sprite = self._make_handle(self._areas[i])
         sc._size_locked = True
         return sc
 
 
     def get_random_tile_component(self) -> 'SpriteComponent':
-        i = random.randint(0, len(self._tiles))
+        i = random.randrange(0, len(self._areas))
         return self.get_tile_component(i)
     
     
     def get_tile_size(self) -> Tuple[int, int]:
         return (self._sx, self._sy)
 
+# Tiled stores flip flags in the high bits of gids
+TILED_GID_MASK = 0x0FFFFFFF
+
 class Tilemap:
-    def __init__(self, name:str, tilesets:list[Tileset], size:vec2, tile_size:vec2) -> None:
+    def __init__(self, name:str, tilesets:list[Tileset], size:vec2, tile_size:vec2, chunk_size:int=16) -> None:
+        self._name = name
         self._tilesets = SortedDict({t._start_index:t for t in tilesets})
         self._sx = tile_size.x
         self._sy = tile_size.y
         self._size = size if size else vec2()
         self.map   = np.zeros((int(size[0]), int(size[1])), dtype=int)
-        self.image = Image(name, (size[0]*self._sx, size[1]*self._sy))
+        self.image:Image|None = None      # Whole map, only built by compute()
+        self.chunk_size = chunk_size        # In tiles
+        self._lookup:np.ndarray|None = None
+        self._lookup_tiles:list[tuple[Tileset, int]] = []
+        self._lookup_atlases:list[pygame.Surface] = []
+        self._lookup_areas:list[pygame.Rect] = []
+    
+    def _build_lookup(self) -> None:
+        """
+        gid -> index in the _lookup_ lists, -1 for empty cells. 
+        Each gid belongs to the tileset with the greatest first gid below it.
+        """
+        size = 1
+        for start, tileset in self._tilesets.items():
+            size = max(size, start+len(tileset))
+        lookup = np.full(size, -1, dtype=np.int32)
+        self._lookup_tiles, self._lookup_atlases, self._lookup_areas = [], [], []
+        for start, tileset in self._tilesets.items():
+            n = len(tileset)
+            lookup[start:start+n] = np.arange(len(self._lookup_tiles), len(self._lookup_tiles)+n)
+            self._lookup_tiles.extend((tileset, i) for i in range(n))
+            self._lookup_atlases.extend([tileset.atlas]*n)
+            self._lookup_areas.extend(tileset._areas)
+        self._lookup = lookup
+    
+    def lookup(self, gids:np.ndarray) -> np.ndarray:
+        """
+        Tile indices of an array of gids, -1 for empty cells
+        """
+        if self._lookup is None:
+            self._build_lookup()
+        assert self._lookup is not None
+        gids = np.asarray(gids) & TILED_GID_MASK
+        if gids.size and gids.max()>=len(self._lookup):
+            raise RuntimeError("Tile does not exist")
+        return self._lookup[gids]
     
     def get_tile(self, idx:int) -> Image:
-        index=idx+1
-        i=1
-        for j in self._tilesets.keys():
-            if index<j:
-                if index<=i:
-                    raise RuntimeError("Tile does not exist")
-                return self._tilesets[i].get_tile(index-i-1)
-            i=j
-        if index>=i:
-            return self._tilesets[i].get_tile(index-i-1)
-        log("Tile not found {}".format(index), logTypes.error)
-        return self._tilesets[self._tilesets.keys()[0]].get_tile(index)
+        k = int(self.lookup(np.array(idx)))
+        if k<0:
+            raise RuntimeError("Tile does not exist")
+        tileset, i = self._lookup_tiles[k]
+        return tileset.get_tile(i)
+    
+    def blit_tiles(self, target:pygame.Surface, gids:np.ndarray) -> None:
+        """
+        Draws a block of gids on target from the tileset atlases, in a single Surface.blits call
+        """
+        indices = self.lookup(gids)
+        rows, cols = np.nonzero(indices>=0)
+        atlases = self._lookup_atlases
+        areas = self._lookup_areas
+        target.blits([(atlases[k], (x, y), areas[k]) for k, x, y in zip(indices[rows, cols].tolist(), (cols*int(self._sx)).tolist(), (rows*int(self._sy)).tolist())], doreturn=False)
 
     def compute(self):
+        if not self.image:
+            self.image = Image(self._name, (self._size[0]*self._sx, self._size[1]*self._sy))
+        self.blit_tiles(self.image.get_data(), self.map)
+    
+    @property
+    def chunk_count(self) -> Tuple[int, int]:
+        """
+        Number of chunk rows and columns
+        """
         m, n = self.map.shape
-        for i in range(m):
-            for j in range(n):
-                tile = self.get_tile(self.map[i, j])
-                self.image.get_data().blit(tile.get_data(), (j*self._sy, i*self._sx))
+        return -(-m//self.chunk_size), -(-n//self.chunk_size)
+    
+    def render_chunk(self, row:int, col:int) -> pygame.Surface:
+        """
+        Renders the tiles of one chunk, at the tileset resolution
+        """
+        cs = self.chunk_size
+        chunk = self.map[row*cs:(row+1)*cs, col*cs:(col+1)*cs]
+        m, n = chunk.shape
+        surface = pygame.Surface((int(n*self._sx), int(m*self._sy)), pygame.SRCALPHA)
+        self.blit_tiles(surface, chunk)
+        return surface
     
     def set_random(self):
-        n = max(self._tilesets.keys())+self._tilesets[max(self._tilesets.keys())]._start_index - 1
-        self.map = np.random.randint(n, size=(int(self._size[0]), int(self._size[1])))
+        if self._lookup is None:
+            self._build_lookup()
+        assert self._lookup is not None
+        self.map = np.random.randint(1, len(self._lookup), size=(int(self._size[0]), int(self._size[1])))
         self.compute()
     
     @property
@@ -449,6 +573,117 @@ def import_tiled_tilemap(name:str, path:str, tileset:Tileset) -> Tilemap:
     return tm
 
 
+class MapCache:
+    """
+    Compiled form of a Tiled map: layer arrays in a .npz and every layer pre-rendered as raw RGBA pixels.
+    Sources (map and tileset images) are checked by size and mtime, then by content hash if those changed.
+    """
+    VERSION = 1
+
+    def __init__(self, cache_dir:str, map_path:str) -> None:
+        self.map_path = os.path.abspath(map_path)
+        key = hashlib.sha1(self.map_path.encode()).hexdigest()[:16]
+        self.dir = os.path.join(cache_dir, Path(map_path).stem+"_"+key)
+        self._manifest_path = os.path.join(self.dir, "manifest.json")
+        self.manifest:dict = {}
+
+    @staticmethod
+    def hash_file(path:str) -> str:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1<<20), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    @staticmethod
+    def stat_file(path:str) -> dict:
+        st = os.stat(path)
+        return {"size": st.st_size, "mtime": st.st_mtime_ns}
+
+    def is_valid(self) -> bool:
+        try:
+            with open(self._manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if manifest.get("version")!=self.VERSION:
+            return False
+
+        stale = False
+        for path, info in manifest["sources"].items():
+            try:
+                stat = self.stat_file(path)
+            except OSError:
+                return False
+            if stat["size"]!=info["size"]:
+                return False
+            if stat["mtime"]!=info["mtime"]:
+                # Touched, but maybe not modified
+                if self.hash_file(path)!=info["sha1"]:
+                    return False
+                info["mtime"] = stat["mtime"]
+                stale = True
+        self.manifest = manifest
+        if stale:
+            self._write_manifest()
+        return True
+
+    def _write_manifest(self) -> None:
+        tmp = self._manifest_path+".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp, self._manifest_path)
+
+    def store(self, sources:list[str], tilemaps:list['Tilemap']) -> None:
+        os.makedirs(self.dir, exist_ok=True)
+        # Invalidate first, so a crash while writing can't leave a valid looking cache
+        if os.path.exists(self._manifest_path):
+            os.remove(self._manifest_path)
+        np.savez(os.path.join(self.dir, "layers.npz"), *[tm.map for tm in tilemaps])
+        sizes = []
+        for i, tm in enumerate(tilemaps):
+            sizes.append(self._store_render(i, tm))
+        tile_size = [int(tilemaps[0]._sx), int(tilemaps[0]._sy)] if tilemaps else [0, 0]
+        self.manifest = {
+            "version": self.VERSION,
+            "tile_size": tile_size,
+            "layers": sizes,
+            "sources": {os.path.abspath(p): dict(self.stat_file(p), sha1=self.hash_file(p)) for p in sources},
+        }
+        self._write_manifest()
+
+    def _store_render(self, i:int, tm:'Tilemap') -> list[int]:
+        """
+        Renders layer i chunk by chunk into its raw file, the whole layer is never held in memory
+        """
+        tw, th = int(tm._sx), int(tm._sy)
+        w, h = tm.width*tw, tm.height*th
+        pixels = np.memmap(os.path.join(self.dir, "layer_{}.raw".format(i)), dtype=np.uint8, mode="w+", shape=(h, w, 4))
+        rows, cols = tm.chunk_count
+        cs = tm.chunk_size
+        for r in range(rows):
+            for c in range(cols):
+                chunk = tm.render_chunk(r, c)
+                cw, ch = chunk.get_size()
+                x, y = c*cs*tw, r*cs*th
+                pixels[y:y+ch, x:x+cw] = np.frombuffer(pygame.image.tobytes(chunk, "RGBA"), dtype=np.uint8).reshape(ch, cw, 4)
+        pixels.flush()
+        del pixels
+        return [w, h]
+
+    def load_layers(self) -> list[np.ndarray]:
+        with np.load(os.path.join(self.dir, "layers.npz")) as data:
+            return [data["arr_{}".format(i)] for i in range(len(data.files))]
+
+    def load_render(self, i:int) -> pygame.Surface:
+        """
+        Layer i, backed by a memory map of the cache file: only the pixels drawn are read from disk
+        """
+        w, h = self.manifest["layers"][i]
+        pixels = np.memmap(os.path.join(self.dir, "layer_{}.raw".format(i)), dtype=np.uint8, mode="r", shape=(h*w*4,))
+        return pygame.image.frombuffer(pixels, (w, h), "RGBA")
+
+
 def get_image_size_tuple(size):
     if size==None:
         return None
@@ -460,6 +695,153 @@ def get_image_size_tuple(size):
         return size
     raise RuntimeError("Unknown type for image size")
 
+def quantize_image_size(original:tuple[int, int], size, steps:int, up:bool=False) -> tuple[int, int]:
+    """
+    Rounds each dimension of size to the nearest original*2^(k/steps), or to the next one with up
+    """
+    quantized = []
+    for o, s in zip(original, size):
+        if s<1:
+            quantized.append(1)
+            continue
+        level = (math.ceil if up else round)(math.log2(s/o)*steps)
+        quantized.append(max(1, round(o*2**(level/steps))))
+    return (quantized[0], quantized[1])
+
+class ImageCache:
+    """
+    Decoded originals are pinned, sized variants are kept in LRU order within a byte budget.
+    Variants are always scaled from the pinned original, never reloaded from disk.
+    """
+    def __init__(self, budget:int=64*1024*1024) -> None:
+        self.budget = budget
+        self._originals:dict[str, tuple[pygame.Surface, Image]] = {}
+        self._variants:OrderedDict[tuple[str, tuple[int, int], bool], Image] = OrderedDict()   # name, size, smoothed
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def surface_bytes(surface:pygame.Surface) -> int:
+        return surface.get_width()*surface.get_height()*surface.get_bytesize()
+    
+    def has(self, name:str) -> bool:
+        return name in self._originals
+    
+    def path_of(self, name:str) -> str:
+        return self._originals[name][1].path
+    
+    def set_original(self, name:str, surface:pygame.Surface, path:str) -> Image:
+        self.drop(name)
+        s = surface.get_size()
+        img = Image(name, vec2(s[0], s[1]), path, surface)
+        self._originals[name] = (surface, img)
+        return img
+    
+    def drop(self, name:str) -> None:
+        self._originals.pop(name, None)
+        for key in [key for key in self._variants if key[0]==name]:
+            self.used -= self.surface_bytes(self._variants.pop(key).get_data())
+    
+    def get(self, name:str, size:tuple[int, int]|None) -> Image:
+        surface, original = self._originals[name]
+        if size is None or tuple(size)==surface.get_size():
+            self.hits += 1
+            return original
+        return self._variant(name, (int(size[0]), int(size[1])), False)
+    
+    def get_level(self, name:str, size, steps:int) -> Image:
+        """
+        Nearest mip level of the requested size. There are `steps` levels per octave of the original size,
+        made with smoothscale: a zooming camera only creates a variant when it crosses a level.
+        """
+        surface, original = self._originals[name]
+        level_size = quantize_image_size(surface.get_size(), size, steps)
+        if level_size==surface.get_size():
+            self.hits += 1
+            return original
+        return self._variant(name, level_size, True)
+    
+    def _variant(self, name:str, size:tuple[int, int], smooth:bool) -> Image:
+        key = (name, size, smooth)
+        img = self._variants.get(key)
+        if img is not None:
+            self._variants.move_to_end(key)
+            self.hits += 1
+            return img
+        
+        self.misses += 1
+        surface, original = self._originals[name]
+        if smooth and surface.get_bitsize()>=24:
+            scaled = pygame.transform.smoothscale(surface, size)
+        else:
+            scaled = pygame.transform.scale(surface, size)
+        img = Image(name, vec2(size[0], size[1]), original.path, scaled)
+        self._variants[key] = img
+        self.used += self.surface_bytes(scaled)
+        self.evict()
+        return img
+    
+    def evict(self) -> None:
+        while self.used>self.budget and self._variants:
+            _, img = self._variants.popitem(last=False)
+            self.used -= self.surface_bytes(img.get_data())
+            self.evictions += 1
+
+
+class RenderQueue:
+    """
+    Collects blits and submits them with one Surface.blits call per layer.
+    Code drawing directly on the target must flush it first to stay above the queued sprites:
+    the scene flushes at the end of Scene.draw and before light_pass, the game before immediate
+    debug draws and at the start of end_frame, before the debug primitives and texts.
+    """
+    def __init__(self) -> None:
+        self._layers:dict[int, list[tuple]] = {}
+        self.blits = 0
+        self.bytes = 0
+        self.last_frame_blits = 0
+        self.last_frame_bytes = 0
+    
+    def submit(self, surface:pygame.Surface, dest, area:pygame.Rect|None=None, flags:int=0, layer:int=0) -> None:
+        batch = self._layers.get(layer)
+        if batch is None:
+            batch = self._layers[layer] = []
+        batch.append((surface, dest, area, flags))
+        w, h = (area.width, area.height) if area else surface.get_size()
+        self.blits += 1
+        self.bytes += w*h*surface.get_bytesize()
+    
+    def submit_many(self, blits:list[tuple], layer:int=0, nbytes:int|None=None) -> None:
+        """
+        Submits (surface, dest) or (surface, dest, area, flags) tuples, nbytes avoids measuring every surface
+        """
+        batch = self._layers.get(layer)
+        if batch is None:
+            batch = self._layers[layer] = []
+        batch.extend(blits)
+        self.blits += len(blits)
+        if nbytes is None:
+            nbytes = 0
+            for blit in blits:
+                w, h = blit[0].get_size()
+                nbytes += w*h*blit[0].get_bytesize()
+        self.bytes += nbytes
+    
+    def flush(self, target:pygame.Surface) -> None:
+        if not self._layers: return
+        for layer in sorted(self._layers):
+            target.blits(self._layers[layer], doreturn=False)
+        self._layers.clear()
+    
+    def end_frame(self) -> None:
+        self.last_frame_blits = self.blits
+        self.last_frame_bytes = self.bytes
+        self.blits = 0
+        self.bytes = 0
+
+
 class Game:
     def __init__(self, size:tuple[int, int]=(640, 480)):
         if Globals.game: raise RuntimeError("There can exist only one game")
@@ -473,10 +855,14 @@ class Game:
         self._target_fps = 60
         self._background_color = Colors.black
         self._events = []
-        self._images = {}
+        self._images = ImageCache()
+        self._preloaded:dict[str, pygame.Surface] = {}     # path: surface decoded by a preloader, until load_image takes it
+        self.render_queue = RenderQueue()
+        self.map_cache_dir:str|None = None     # Compiled map cache directory, disabled until set_map_cache_dir
         self.active_scene : Scene = Scene()
 
-        self._frame_debugs = []
+        self.debug_buffer = DebugBuffer()
+        self.debug_categories:dict[str, bool] = {}     # Categories missing here are enabled
         self.debug_infos:dict[str, str] = {"fps": "0", "deltatime": "0"}
         self._no_debug = False
     
@@ -487,14 +873,35 @@ class Game:
         self.title = title
         pygame.display.set_caption(title)
         self._clock = pygame.time.Clock()
-        self.load_font("debug_default", "engine/debug_font.ttf")
-
-        self.load_image("default", "engine/default.png")
-        self.load_image("default_shadow", "engine/default_shadow.png")
-        self.load_image("default_particle", "engine/default_particle.png")
+        manifest = AssetManifest()
+        manifest.add_font("debug_default", "engine/debug_font.ttf")
+        manifest.add_image("default", "engine/default.png")
+        manifest.add_image("default_shadow", "engine/default_shadow.png")
+        manifest.add_image("default_particle", "engine/default_particle.png")
+        self.preload(manifest).wait()
 
         return self
     
+    def preload(self, manifest:AssetManifest|str, workers:int|None=None) -> AssetPreloader:
+        """
+        Starts decoding the assets of a manifest (or of a manifest JSON file) in the background.
+        Call poll() on the returned preloader once per frame (or wait()) to make the finished assets available,
+        load_image/load_font then use them instead of reading the disk.
+        """
+        if isinstance(manifest, str):
+            manifest = AssetManifest.from_json(self.resource_path(manifest))
+        preloader = AssetPreloader(manifest, workers, self.resource_path)
+        def on_image(entry, surface):
+            self._images.set_original(entry.name, surface, entry.path)
+            if entry.size is None:
+                self._preloaded[entry.path] = surface
+            log("Preloaded image {}".format(entry.name), logTypes.trace)
+        def on_font(entry, font):
+            self._fonts[entry.name] = font
+        preloader.on_image = on_image
+        preloader.on_font = on_font
+        return preloader.start()
+    
     def load_font(self, name, path, size=28, force_reload=False):
         if (not self._fonts.get(name)) or force_reload:
             self._fonts[name] = pygame.font.Font(path, size)
@@ -511,32 +918,39 @@ class Game:
         return os.path.join(base_path, relative_path)
 
     def load_image(self, name, path="", size=None, force_reload=False):
-        if self._images.get(name):
-            if (not force_reload) and self._images[name].get(get_image_size_tuple(size)):
-                return self._images[name][get_image_size_tuple(size)]
-            else:
-                if size:
-                    p=self.resource_path(next(iter(self._images[name].values())).path)
-                    log("Loading image {} from disk with size ({}, {})".format(name, size[0], size[1]), logTypes.trace)
-                    im = pygame.image.load(p).convert_alpha()
-                    im = pygame.transform.scale(im, size)
-                    s = im.get_size()
-                    img = Image(name, vec2(s[0], s[1]), path, im)
-                    self._images[name][s] = img
-                    return img
-                else:
-                    return self._images[name][max(self._images[name])]
+        size = get_image_size_tuple(size)
+        if self._images.has(name) and not force_reload:
+            if self._preloaded:
+                # Already installed under this name by the preloader
+                self._preloaded.pop(path or self._images.path_of(name), None)
+            return self._images.get(name, size)
         if not path:
-            raise RuntimeError("Never loaded this resource and no path specified ("+name+")")
-        im = pygame.image.load(self.resource_path(path)).convert_alpha()
-        log("Loading image {} from disk with {}".format(name, "size {}".format(size) if size else "default size"), logTypes.trace)
-        if size:
-            im = pygame.transform.scale(im, size)
-        s = im.get_size()
-        img = Image(name, vec2(s[0], s[1]), path, im)
-        self._images[name] = {}
-        self._images[name][s] = img
-        return img
+            if not self._images.has(name):
+                raise RuntimeError("Never loaded this resource and no path specified ("+name+")")
+            path = self._images.get(name, None).path
+        # Handed over once: the image cache owns the surface from now on
+        im = self._preloaded.pop(path, None)
+        if im is None or force_reload:
+            im = pygame.image.load(self.resource_path(path)).convert_alpha()
+            log("Loading image {} from disk".format(name), logTypes.trace)
+        self._images.set_original(name, im, path)
+        return self._images.get(name, size)
+    
+    def load_image_level(self, name, size, steps:int, path=""):
+        """
+        Same as load_image, but returns the nearest quantized zoom level of the image (see ImageCache.get_level)
+        """
+        if not self._images.has(name):
+            self.load_image(name, path)
+        return self._images.get_level(name, size, steps)
+    
+    def set_image_budget(self, budget:int):
+        """
+        Bytes kept for resized image variants, originals are not counted
+        """
+        self._images.budget = budget
+        self._images.evict()
+        return self
 
     def is_alive(self):
         return self._alive
@@ -572,69 +986,99 @@ class Game:
     
     def end_frame(self):
         self._delta_time = self._clock.get_time()
+        self.render_queue.flush(self.screen)
+        self.render_queue.end_frame()
+        if profiler.enabled:
+            profiler.end_frame()
         if not self._no_debug:
-            for debug in self._frame_debugs:
-                debug.draw(self.screen)
-            self._frame_debugs = []
+            self.debug_buffer.flush(self.screen, self.camera)
             current_height = 10
             self.debug_infos["fps"] = str(round(self._clock.get_fps()))
             self.debug_infos["deltatime"] = str(round(self._clock.get_time(), 1))
+            self.debug_infos["blits"] = str(self.render_queue.last_frame_blits)
+            self.debug_infos["blit_kb"] = str(self.render_queue.last_frame_bytes//1024)
+            self.debug_infos["image_cache_kb"] = str(self._images.used//1024)
+            self.debug_infos["image_hits"] = str(self._images.hits)
+            self.debug_infos["image_misses"] = str(self._images.misses)
+            self.debug_infos["image_evictions"] = str(self._images.evictions)
+            if profiler.enabled:
+                for scope, duration in profiler.last_frame.items():
+                    self.debug_infos[scope] = "{:.2f} ms".format(duration)
+            font = self._fonts["debug_default"]
             for debug in self.debug_infos:
-                txt = str(debug) + ": " + str(self.debug_infos[debug])
-                img = self._fonts["debug_default"].render(txt, True, (255, 255, 255))
-                rect = img.get_rect()
-                self.screen.blit(img, (self.size[0]-rect.width-10, current_height))
-                current_height+=rect.height+5
+                # Labels come from the string cache, changing values are composed from the glyph atlas
+                label = str(debug) + ": "
+                value = str(self.debug_infos[debug])
+                label_width, label_height = text_renderer.size(font, label, Colors.white)
+                value_width, value_height = text_renderer.size(font, value, Colors.white)
+                x = self.size[0]-label_width-value_width-10
+                text_renderer.draw(self.screen, font, label, (x, current_height), Colors.white)
+                text_renderer.draw(self.screen, font, value, (x+label_width, current_height), Colors.white)
+                current_height+=max(label_height, value_height)+5
         
         pygame.display.flip()
         self._clock.tick(self._target_fps)
         return
     
-    def draw_debug_vector(self, start : vec3, end : vec3, color=(255,0,0), immediate=False):
-        if self._no_debug: return
-        vector = DebugVector(self)
-        vector.start = start
-        vector.end = end
-        vector.color = color
+    def debug_active(self, category:str="default") -> bool:
+        """
+        Whether debug primitives of this category are recorded, check it before computing costly ones
+        """
+        return not self._no_debug and self.debug_categories.get(category, True)
+    
+    def set_debug_category(self, category:str, enabled:bool=True):
+        self.debug_categories[category] = enabled
+        return self
+    
+    def draw_debug_vector(self, start : vec3, end : vec3, color=(255,0,0), immediate=False, category="default"):
+        if self._no_debug or not self.debug_categories.get(category, True): return
         if immediate:
+            self.render_queue.flush(self.screen)    # Drawn over the sprites submitted before
+            vector = DebugVector(self)
+            vector.start = start
+            vector.end = end
+            vector.color = color
             vector.draw(self.screen)
-        else:
-            self._frame_debugs.append(vector)
+        elif start!=end:
+            self.debug_buffer.add_segment(DebugBuffer.VECTOR, start, end, color)
         
-    def draw_debug_spring(self, start : vec3, end : vec3, color=(255,0,0), immediate=False):
-        if self._no_debug: return
-        spring = DebugSpring(self)
-        spring._start = start
-        spring._end = end
-        spring._color = color
+    def draw_debug_spring(self, start : vec3, end : vec3, color=(255,0,0), immediate=False, category="default"):
+        if self._no_debug or not self.debug_categories.get(category, True): return
         if immediate:
+            self.render_queue.flush(self.screen)    # Drawn over the sprites submitted before
+            spring = DebugSpring(self)
+            spring._start = start
+            spring._end = end
+            spring._color = color
             spring.draw(self.screen)
-        else:
-            self._frame_debugs.append(spring)
+        elif start!=end:
+            self.debug_buffer.add_lines(spring_points(start, end), color)
         
-    def draw_debug_rectangle(self, start : vec2, end : vec2, color=(0,0,255), immediate=False, thickness=1):
-        if self._no_debug: return
-        square = DebugRectangle(self)
-        square.start = start
-        square.end = end
-        square.color = color
-        square.thickness = thickness
+    def draw_debug_rectangle(self, start : vec2, end : vec2, color=(0,0,255), immediate=False, thickness=1, category="default"):
+        if self._no_debug or not self.debug_categories.get(category, True): return
         if immediate:
+            self.render_queue.flush(self.screen)    # Drawn over the sprites submitted before
+            square = DebugRectangle(self)
+            square.start = start
+            square.end = end
+            square.color = color
+            square.thickness = thickness
             square.draw(self.screen)
-        else:
-            self._frame_debugs.append(square)
-
-    def draw_debug_box(self, start : vec3, end : vec3, color=(0,0,255), immediate=False, thickness=1):
-        if self._no_debug: return
-        square = DebugBox(self)
-        square.start = start
-        square.end = end
-        square.color = color
-        square.thickness = thickness
+        elif start!=end:
+            self.debug_buffer.add_segment(DebugBuffer.RECT, start, end, color, thickness, screen_space=True)
+
+    def draw_debug_box(self, start : vec3, end : vec3, color=(0,0,255), immediate=False, thickness=1, category="default"):
+        if self._no_debug or not self.debug_categories.get(category, True): return
         if immediate:
+            self.render_queue.flush(self.screen)    # Drawn over the sprites submitted before
+            square = DebugBox(self)
+            square.start = start
+            square.end = end
+            square.color = color
+            square.thickness = thickness
             square.draw(self.screen)
-        else:
-            self._frame_debugs.append(square)
+        elif start!=end:
+            self.debug_buffer.add_segment(DebugBuffer.RECT, start, end, color, thickness)
     
     def load_scene(self, scene:'Scene'):
         self.active_scene = scene
@@ -645,6 +1089,21 @@ class Game:
         self._no_debug = not debug
         return self
     
+    def set_map_cache_dir(self, path:str|None):
+        """
+        Enables the compiled map cache in path (made absolute, so it doesn't follow the working directory), None disables it
+        """
+        self.map_cache_dir = os.path.abspath(path) if path else None
+        return self
+    
+    def set_profiling(self, val:bool):
+        profiler.enable(val)
+        if not val:
+            for scope in profiler.last_frame:
+                self.debug_infos.pop(scope, None)
+            profiler.clear()
+        return self
+    
     @property
     def camera(self) -> 'Camera':
         return self.active_scene.active_camera
@@ -684,9 +1143,9 @@ class SceneComponent(Component):
         self._pos:vec3 = pos if pos else vec3()
         self._size:vec3 = vec3(0.5, 0.5, 0.5)
         self._scene_parent:bool = True if issubclass(type(parent), SceneComponent) else False
-        self._parent_pos:vec3 = parent.get_world_position() if self._scene_parent else vec3() # type: ignore
-        self._valid:bool = False
-        self._update_count:int = 0
+        self._world_pos:vec3 = vec3()
+        self._valid:bool = False        # False when _world_pos is stale, then it is also False for the whole subtree
+        self._update_count:int = 0      # Number of times the world position was recomputed
         self._inherit_parent_position = True
     
     def get_local_position(self):
@@ -694,15 +1153,27 @@ class SceneComponent(Component):
     
     def set_local_position(self, val):
         self._pos = val
-        self._valid = False
-        # for c in self._children:
-        #     c.invalidate()
+        self.invalidate()
     
     def set_inherit_parent_location(self, val:bool) -> None:
         self._inherit_parent_position = val
+        self.invalidate()
     
     def get_world_position(self):
-        return self._parent_pos+self._pos
+        """
+        Cached until this component or one of its parents moves, must not be modified in place
+        """
+        if not self._valid:
+            self._update_world_position()
+        return self._world_pos
+    
+    def _update_world_position(self) -> None:
+        if self._scene_parent and self._inherit_parent_position:
+            self._world_pos = self._parent.get_world_position()+self._pos # type: ignore
+        else:
+            self._world_pos = vec3(self._pos)
+        self._update_count += 1
+        self._valid = True
 
     @property
     def size(self):
@@ -721,21 +1192,28 @@ class SceneComponent(Component):
     
     def attach(self, parent:'SceneComponent'):
         Component.attach(self, parent)
-        self._parent_pos = parent.get_world_position() if self._inherit_parent_position else vec3()
+        self._scene_parent = issubclass(type(parent), SceneComponent)
         self.invalidate()
     
     def invalidate(self):
+        """
+        Marks the world position of this component and of its subtree as stale.
+        Components changing _pos in place must call it.
+        """
+        if not self._valid: return      # The subtree is already stale
         self._valid = False
+        for child in self._children:
+            if isinstance(child, SceneComponent):
+                child.invalidate()
 
     def update(self):
-        # if self._valid: return
-        # self._update_count+=1
-        if self._parent: self._parent_pos=self._parent.get_world_position() if self._inherit_parent_position else vec3()
+        """
+        Recomputes the stale world positions of the subtree, subtrees that did not move are skipped
+        """
+        if self._valid: return
+        self._update_world_position()
         for child in self._children:
-            # child._parent_pos = vec3(self._parent_pos+self._pos)
             child.update()
-        self._valid = True
-        return
 
 class Camera(SceneComponent):
     def __init__(self, parent:SceneComponent|None=None, pos:vec3|None=None) -> None:
@@ -747,6 +1225,10 @@ class Camera(SceneComponent):
     def world_to_screen(self, world : vec3) -> vec2:
         return vec2()
     
+    def world_to_screen_many(self, world:np.ndarray, cull:bool=False, margin:tuple[float, float]=(0, 0)):
+        screen = np.zeros((len(world), 2), dtype=np.int32)
+        return (screen, np.ones(len(world), dtype=bool)) if cull else screen
+    
     def world_to_cam(self, world : vec3) -> vec3:
         return vec3()
 
@@ -785,10 +1267,37 @@ class OrthographicCamera(Camera):
         y = ((p.y-world.z)/self.bounds.y + self.offset.y)*self.screen_size.y
         return vec2(int(x), int(y))
     
+    def world_to_screen_many(self, world:np.ndarray, cull:bool=False, margin:tuple[float, float]=(0, 0)):
+        """
+        world_to_screen of an (N, 3) array of points, as an (N, 2) int32 array.
+        With cull, also returns the mask of the points at most margin (x, y) pixels outside of the screen.
+        """
+        p = self.get_world_position()
+        world = np.asarray(world)
+        screen = np.empty((len(world), 2), dtype=np.int32)
+        # Assigning to int32 truncates toward zero, like int()
+        screen[:, 0] = ((world[:, 0]-p.x)/self.bounds.x + self.offset.x)*self.screen_size.x
+        screen[:, 1] = ((world[:, 1]-p.y-world[:, 2])/self.bounds.y + self.offset.y)*self.screen_size.y
+        if not cull:
+            return screen
+        x, y = screen[:, 0], screen[:, 1]
+        mx, my = margin
+        visible = (x+mx>=0) & (y+my>=0) & (x-mx<=self.screen_size.x) & (y-my<=self.screen_size.y)
+        return screen, visible
+    
     def set_zoom(self, zoom : float) -> None:
         self.bounds*=1/abs(self.zoom-zoom)
         self.zoom = clamp(zoom, 0, 3)
     
+    def get_view_bounds(self) -> Tuple[float, float, float, float]:
+        """
+        World rectangle seen at z=0, as xmin, ymin, xmax, ymax
+        """
+        p = self.get_world_position()
+        xmin = p.x-self.offset.x*self.bounds.x
+        ymin = p.y-self.offset.y*self.bounds.y
+        return xmin, ymin, xmin+self.bounds.x, ymin+self.bounds.y
+    
     def world_size2_to_screen(self, dim : vec2) -> vec2:
         x = dim.x*self.screen_size.x/self.bounds.x
         y = dim.y*self.screen_size.y/self.bounds.y
@@ -802,16 +1311,67 @@ class Drawable():
     def draw(self):
         return
 
+def _update_depth(drawable:'DrawableComponent') -> float:
+    drawable._depth = drawable.get_world_position().y
+    return drawable._depth
+
+def _depth_key(drawable:'DrawableComponent') -> float:
+    return drawable._depth if drawable._static else _update_depth(drawable)
+
+def _draw_key(drawable:'DrawableComponent') -> tuple[float, int]:
+    # Equal depths are drawn in registration order, so overlapping drawables don't flicker
+    return _depth_key(drawable), drawable._order
+
 class DrawableComponent(SceneComponent, Drawable):
+    _depth:float = 0.       # World y of the last depth sort, drawables are drawn by increasing depth
+    _static:bool = False
+    _screen_pos:tuple[int, int]|None = None     # Projected by the scene for the next draw
+    _order:int = 0          # Registration index in the scene
+    _grid:Union['DrawableGrid', None] = None     # Scene grid the drawable is bucketed in
+    
     def __init__(self, parent=None, pos=vec3()):
         SceneComponent.__init__(self, parent, pos)
         Drawable.__init__(self)
     
+    def invalidate(self):
+        if self._valid and self._grid is not None and not self._static:
+            self._grid.mark(self)
+        SceneComponent.invalidate(self)
+    
+    def invalidate_bounds(self):
+        """
+        To call when the world bounds change without the component moving
+        """
+        if self._grid is not None and not self._static:
+            self._grid.mark(self)
+    
+    def set_size(self, size:vec3):
+        SceneComponent.set_size(self, size)
+        self.invalidate_bounds()
+        return self
+    
+    def set_static(self, val:bool=True):
+        """
+        Static drawables never move: their depth and bounds are computed once, when registered in a scene
+        """
+        self._static = val
+        return self
+    
+    def get_world_bounds(self) -> Tuple[float, float, float, float]:
+        """
+        World rectangle covered on screen (height shifts it up), as xmin, ymin, xmax, ymax
+        """
+        p = self.get_world_position()
+        hx, hy = self._size.x/2, self._size.y/2
+        y = p.y-p.z
+        return p.x-hx, y-hy, p.x+hx, y+hy
+    
+    # Same order as the scene draws in
     def __le__(self, other):
-        return self._pos.y<=other._pos.y
+        return _draw_key(self)<=_draw_key(other)
     
     def __lt__(self, other):
-        return self._pos.y<other._pos.y
+        return _draw_key(self)<_draw_key(other)
 
 
 class Light(DrawableComponent):
@@ -829,6 +1389,12 @@ class Light(DrawableComponent):
     def draw(self):
         Drawable.draw(self)
     
+    def get_screen_rect(self) -> pygame.Rect|None:
+        """
+        Screen area lit by this light, None if unbounded (never culled)
+        """
+        return None
+    
     def render(self):
         pass
 
@@ -837,25 +1403,85 @@ class PointLight(Light):
         Light.__init__(self, scene, parent, pos)
         # self._light_surface = pygame.Surface((100, 100))
         # self._light_surface.fill('White')
+        self.falloff = "linear"     # One of GRADIENT_FALLOFFS
+        self._scaled_surface:pygame.Surface|None = None   # Light surface at the lightmap resolution
+        self._scaled_for = 1
         self.render()
     
+    def get_screen_rect(self) -> pygame.Rect:
+        return self._light_surface.get_rect(topleft=Globals.game.camera.world_to_screen(self._pos))
+    
+    def get_light_surface(self, scale:int=1) -> pygame.Surface:
+        if scale==1:
+            return self._light_surface
+        if self._scaled_surface is None or self._scaled_for!=scale:
+            w, h = self._light_surface.get_size()
+            self._scaled_surface = generate_radial_gradient(vec3(0, 0, 0), 255, self._color, 255, vec2(w//scale, h//scale), self.falloff)
+            self._scaled_for = scale
+        return self._scaled_surface
+    
     def draw(self):
         Light.draw(self)
-        self._scene.get_light_map().blit(self._light_surface, Globals.game.camera.world_to_screen(self._pos), special_flags=pygame.BLEND_ADD)
+        scale = self._scene.lightmap_scale
+        pos = Globals.game.camera.world_to_screen(self._pos)
+        self._scene.get_light_map().blit(self.get_light_surface(scale), (pos.x//scale, pos.y//scale), special_flags=pygame.BLEND_ADD)
+    
+    def set_falloff(self, falloff:str):
+        self.falloff = falloff
+        return self.render()
     
     def render(self):
         Light.render(self)
         screen_size = Globals.game.camera.world_size2_to_screen(self.size.xy)
-        self._light_surface = generate_radial_gradient(vec3(0, 0, 0), 255, self._color, 255, screen_size)
+        self._light_surface = generate_radial_gradient(vec3(0, 0, 0), 255, self._color, 255, screen_size, self.falloff)
+        self._scaled_surface = None
         return self
 
+class AlphaVariants:
+    """
+    Copies of a surface pre-multiplied at evenly spaced alpha levels, from transparent to opaque.
+    Blitting the nearest variant replaces a set_alpha call per blit.
+    """
+    def __init__(self, surface:pygame.Surface, levels:int=16) -> None:
+        assert levels>=2
+        self.source = surface
+        self.levels = levels
+        self.variants:list[pygame.Surface] = []
+        for i in range(levels):
+            variant = surface.copy()
+            variant.set_alpha(255)     # Clears a surface alpha left by set_alpha users, per-pixel alpha is kept
+            variant.fill((255, 255, 255, round(i*255/(levels-1))), special_flags=pygame.BLEND_RGBA_MULT)
+            self.variants.append(variant)
+    
+    def level(self, alpha:int) -> int:
+        return (alpha*(self.levels-1)+127)//255
+    
+    def levels_of(self, alphas:np.ndarray) -> np.ndarray:
+        return (alphas.astype(np.int32)*(self.levels-1)+127)//255
+    
+    def get(self, alpha:int) -> pygame.Surface:
+        return self.variants[self.level(alpha)]
+    
+    @property
+    def memory(self) -> int:
+        return sum(v.get_width()*v.get_height()*v.get_bytesize() for v in self.variants)
+
+
 class ParticleEmitter(Drawable):
-    def __init__(self, system:Union[None,'ParticleSystem']=None):
+    """
+    Particles live in a pool of arrays, alive particles are kept packed at the front.
+    The pool starts at capacity and doubles when full, up to max_capacity.
+    """
+    MAX_AGE = 5
+    
+    def __init__(self, system:Union[None,'ParticleSystem']=None, capacity:int=64, max_capacity:int=65536):
         Drawable.__init__(self)
         self._rate = 1.0
         self._elapsed_time:int = 0
-        self._particles:deque[tuple[int, MutableBool, vec3, vec3, list[int], int]]=deque()  # particle: id, is_alive, position, velocity, color, creation_time
-        self._sprite:Image=Globals.game.load_image("default_particle").resize((128, 128))
+        self.max_capacity = max_capacity
+        self._count = 0
+        self._allocate(min(capacity, max_capacity))
+        self._sprite:Image=Globals.game.load_image("default_particle", size=(128, 128))
         self._started = False
         self._system = system
         self.draw_size = vec2()
@@ -864,6 +1490,8 @@ class ParticleEmitter(Drawable):
         self._pos = vec3()
         self._track_component:None|SceneComponent = None
         self._alpha_animate=FloatTimelineFadeInOut(0.1)
+        self.alpha_levels = 16          # Pre-baked sprite alpha levels, 0 uses set_alpha before every blit
+        self._alpha_variants:AlphaVariants|None = None
     
     def track_component(self, component:SceneComponent):
         self._track_component = component
@@ -872,8 +1500,63 @@ class ParticleEmitter(Drawable):
         self._started = True
         return self
     
+    @property
+    def count(self) -> int:
+        return self._count
+    
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+    
+    def _allocate(self, capacity:int) -> None:
+        n = self._count
+        def grow(old, shape, dtype=np.float64):
+            arr = np.zeros(shape, dtype=dtype)
+            if old is not None:
+                arr[:n] = old[:n]
+            return arr
+        
+        self._positions = grow(getattr(self, "_positions", None), (capacity, 3))
+        self._velocities = grow(getattr(self, "_velocities", None), (capacity, 3))
+        self._ages = grow(getattr(self, "_ages", None), (capacity,))
+        self._alphas = grow(getattr(self, "_alphas", None), (capacity,), np.uint8)
+        self._alive = grow(getattr(self, "_alive", None), (capacity,), bool)
+        self._capacity = capacity
+    
+    def spawn(self, velocities:np.ndarray) -> int:
+        """
+        Spawns one particle at the emitter position per velocity row, returns how many fit in the pool
+        """
+        needed = self._count+len(velocities)
+        if needed>self._capacity and self._capacity<self.max_capacity:
+            capacity = max(self._capacity, 1)
+            while capacity<needed:
+                capacity *= 2
+            self._allocate(min(capacity, self.max_capacity))
+        n = min(len(velocities), self._capacity-self._count)
+        if n<=0: return 0
+        s = slice(self._count, self._count+n)
+        self._positions[s] = (self._pos.x, self._pos.y, self._pos.z)
+        self._velocities[s] = velocities[:n]
+        self._ages[s] = 0
+        self._alphas[s] = 0
+        self._alive[s] = True
+        self._count += n
+        return n
+    
+    def compact(self) -> None:
+        n = self._count
+        alive = self._alive[:n]
+        if alive.all(): return
+        keep = np.flatnonzero(alive)
+        m = len(keep)
+        for arr in (self._positions, self._velocities, self._ages, self._alphas):
+            arr[:m] = arr[keep]
+        self._alive[:m] = True
+        self._alive[m:n] = False
+        self._count = m
+    
     def tick(self, dt) -> None:
-        MAX_AGE=5
         if not self._started: return
         self._elapsed_time+=dt
         if self._track_component:
@@ -885,52 +1568,88 @@ class ParticleEmitter(Drawable):
             if (not self._size_locked):
                 self._sprite = Globals.game.load_image(self._sprite.name, self._sprite.path, self.draw_size)
             else:
-                self._sprite.resize(self.draw_size)
-             
-        found_alive=False
-        up_to=0
-        i=-1
-        for particle in self._particles:
-            i+=1
-            id, is_alive, position, velocity, color, creation_time = particle
-            if not is_alive.get():
-                if not found_alive: up_to+=1
-                continue
-            found_alive=True
-            age = self._elapsed_time-creation_time
-            normalized_age:float = age/MAX_AGE
-            if normalized_age>1: is_alive.set(False)
-            color[3]=int(self._alpha_animate.get(normalized_age)*255)
-            
-            position+=velocity*dt
-        if not found_alive: self._particles=deque()
-        else:
-            for _ in range(up_to): self._particles.popleft()
-        Globals.game.debug_infos["particles_count"]=str(len(self._particles))
+                self._sprite = self._sprite.resized(self.draw_size)
+        
+        self.compact()
+        n = self._count
+        if n:
+            ages = self._ages[:n]
+            ages += dt
+            normalized_age = ages/self.MAX_AGE
+            self._alive[:n] &= normalized_age<=1
+            self._alphas[:n] = (np.clip(self._alpha_animate.get_many(normalized_age), 0, 1)*255).astype(np.uint8)
+            self._positions[:n] += self._velocities[:n]*dt
+        Globals.game.debug_infos["particles_count"]=str(self._count)
+    
+    def get_world_bounds(self) -> Tuple[float, float, float, float]|None:
+        """
+        Rectangle covered by the alive particles relative to the system origin, as xmin, ymin, xmax, ymax.
+        None without particles.
+        """
+        n = self._count
+        if not n: return None
+        positions = self._positions[:n]
+        x = positions[:, 0]
+        y = positions[:, 1]-positions[:, 2]
+        # Sprites are drawn from their top left corner
+        return float(x.min()), float(y.min()), float(x.max())+self._sprite_size.x, float(y.max())+self._sprite_size.y
         
     def draw(self) -> None:
         assert self._system!=None
         screen = Globals.game.screen
-        camera = Globals.game.camera
-        screen_size = Globals.game.size
-        for particle in self._particles:
-            id, is_alive, position, _, color, _ = particle
-            if not is_alive.get(): continue
-            screen_pos = camera.world_to_screen(position+self._system.get_world_position())
-
-            if screen_pos.x+self.draw_size.x<0 or screen_pos.y+self.draw_size.y<0 or screen_pos.x-self.draw_size.x>screen_size[0] or screen_pos.y-self.draw_size.y>screen_size[1]: is_alive.set(False)
-            self._sprite.get_data().set_alpha(color[3])
-            screen.blit(self._sprite.get_data(), screen_pos)
+        camera:OrthographicCamera = Globals.game.camera   # type: ignore
+        n = self._count
+        if not n: return
+        
+        # Particles leaving the screen die
+        origin = self._system.get_world_position()
+        points, visible = camera.world_to_screen_many(self._positions[:n]+(origin.x, origin.y, origin.z), cull=True, margin=(self.draw_size.x, self.draw_size.y))
+        x, y = points[:, 0], points[:, 1]
+        alive = self._alive[:n]
+        alive &= visible
+        
+        sprite = self._sprite.get_data()
+        # Newest particles first, as they always were
+        indices = np.flatnonzero(alive)[::-1]
+        
+        if self.alpha_levels<2:
+            Globals.game.render_queue.flush(screen)
+            alphas = self._alphas
+            for i in indices.tolist():
+                sprite.set_alpha(int(alphas[i]))
+                screen.blit(sprite, (int(x[i]), int(y[i])))
+            return
+        
+        variants = self._alpha_variants
+        if variants is None or variants.source is not sprite or variants.levels!=self.alpha_levels:
+            variants = self._alpha_variants = AlphaVariants(sprite, self.alpha_levels)
+            Globals.game.debug_infos["particle_sprites_kb"] = str(variants.memory//1024)
+        
+        # Fully transparent particles are skipped, the others are stateless blits
+        levels = variants.levels_of(self._alphas[indices])
+        shown = levels>0
+        surfaces = variants.variants
+        blits = [(surfaces[l], (px, py)) for l, px, py in zip(levels[shown].tolist(), x[indices[shown]].tolist(), y[indices[shown]].tolist())]
+        w, h = sprite.get_size()
+        Globals.game.render_queue.submit_many(blits, layer=1, nbytes=len(blits)*w*h*sprite.get_bytesize())
 
 class FountainEmitter(ParticleEmitter):
-    def __init__(self, system: Union[None, 'ParticleSystem'] = None):
-        ParticleEmitter.__init__(self, system)
+    def __init__(self, system: Union[None, 'ParticleSystem'] = None, capacity:int=64, max_capacity:int=65536):
+        ParticleEmitter.__init__(self, system, capacity, max_capacity)
+        self._rate = 3.0            # Particles per second
+        self._to_spawn = 0.0
     
     def tick(self, dt) -> None:
         if not self._started: return
-
-        if random.random()>0.95:
-            self._particles.appendleft((0, MutableBool(True), self._pos.copy(), set_z(random_vec3_in_cone(vec3(0, -1, 0), np.pi/4*random.random()+np.pi/8)*1, 0), list(Colors.white_a), self._elapsed_time))
+        
+        # Spawn everything due since last tick in one batch
+        self._to_spawn += self._rate*dt
+        n = int(self._to_spawn)
+        if n>0:
+            self._to_spawn -= n
+            velocities = random_vec3_in_cone_many(vec3(0, -1, 0), np.pi/4*np.random.random(n)+np.pi/8)
+            velocities[:, 2] = 0
+            self.spawn(velocities)
 
         ParticleEmitter.tick(self, dt)
 
@@ -946,11 +1665,28 @@ class ParticleSystem(DrawableComponent):
             emitter.start()
         return self
 
+    @profiler.profile("ParticleSystem.tick")
     def tick(self, dt) -> 'ParticleSystem':
         for emitter in self._emitters:
             emitter.tick(dt)
+        # The particles moved
+        self.invalidate_bounds()
         
         return self
+    
+    def get_world_bounds(self) -> Tuple[float, float, float, float]:
+        """
+        Covers the particles of every emitter, they can be far from the system when tracking a component
+        """
+        xmin, ymin, xmax, ymax = DrawableComponent.get_world_bounds(self)
+        p = self.get_world_position()
+        for emitter in self._emitters:
+            bounds = emitter.get_world_bounds()
+            if bounds is None: continue
+            ex0, ey0, ex1, ey1 = bounds
+            xmin, ymin = min(xmin, p.x+ex0), min(ymin, p.y-p.z+ey0)
+            xmax, ymax = max(xmax, p.x+ex1), max(ymax, p.y-p.z+ey1)
+        return xmin, ymin, xmax, ymax
 
     def draw(self) -> 'ParticleSystem':
         DrawableComponent.draw(self)
@@ -1024,38 +1760,256 @@ class DebugSpring(DebugDraw):
         self._thickness = 1
     
     def draw(self, screen):
-        ends_length = 0.5
-        num_spires = 15
-        width=0.5
-        camera = self.game.camera
         if self._start==self._end: return
-        unit = (self._end-self._start).normalize()
-        length = (self._end-self._start).length()
-        ends_length=min(ends_length, length/2)
-        side=vec3(0,0,1).cross(unit).normalize() if vec3(0,0,1).dot(unit)==0 else vec3(0,1,0).cross(unit).normalize()
-        offset = self._start+unit*ends_length
-        pygame.draw.line(screen, self._color, camera.world_to_screen(self._start), camera.world_to_screen(offset), self._thickness)
-        stride = (length-2*ends_length)/num_spires
-        for i in range(num_spires):
-            pygame.draw.lines(screen, self._color, False, [camera.world_to_screen(offset+i*stride*unit), camera.world_to_screen(offset+i*stride*unit+stride/2*unit+(width*side if i%2 else -width*side)), camera.world_to_screen(offset+(i+1)*stride*unit)])
-        pygame.draw.line(screen, self._color, camera.world_to_screen(self._end-unit*ends_length), camera.world_to_screen(self._end), self._thickness)
+        points = self.game.camera.world_to_screen_many(spring_points(self._start, self._end))
+        pygame.draw.lines(screen, self._color, False, points.tolist(), self._thickness)
+
+def spring_points(start:vec3, end:vec3, num_spires:int=15, width:float=0.5, ends_length:float=0.5) -> np.ndarray:
+    """
+    World points of a spring polyline: start, a zigzag of one peak per spire, end
+    """
+    unit = (end-start).normalize()
+    length = (end-start).length()
+    ends_length=min(ends_length, length/2)
+    side=vec3(0,0,1).cross(unit).normalize() if vec3(0,0,1).dot(unit)==0 else vec3(0,1,0).cross(unit).normalize()
+    offset = start+unit*ends_length
+    stride = (length-2*ends_length)/num_spires
+    
+    steps = np.arange(num_spires+1, dtype=np.float64)
+    along = np.empty(2*num_spires+1)
+    along[0::2] = steps*stride
+    along[1::2] = (steps[:-1]+.5)*stride
+    sides = np.zeros(2*num_spires+1)
+    sides[1::2] = np.where(np.arange(num_spires)%2, width, -width)
+    points = np.empty((2*num_spires+3, 3))
+    points[0] = start
+    points[1:-1] = np.outer(along, unit) + np.outer(sides, side) + offset
+    points[-1] = end
+    return points
+
+class DebugBuffer:
+    """
+    Debug primitives of a frame, appended to two flat buffers instead of DebugDraw objects.
+    The buffers are plain lists, the cheapest to append to, turned into arrays once per frame:
+    flush() projects every world point with one world_to_screen_many call,
+    turns every primitive into a polyline and groups them by style.
+    """
+    LINES = 0       # Polyline through the points
+    VECTOR = 1      # Arrow from the first point to the second
+    RECT = 2        # Rectangle between two corners
+    
+    def __init__(self) -> None:
+        self._points:list[float] = []       # x, y, z per point, screen space points have z=0
+        self._commands:list[float] = []     # kind, first point, point count, screen space, r, g, b, thickness
+    
+    def __len__(self) -> int:
+        return len(self._commands)//8
+    
+    def add_segment(self, kind:int, start, end, color, thickness:int=1, screen_space:bool=False) -> None:
+        color = pygame.Color(color)     # Also accepts color names and vec3
+        points = self._points
+        self._commands.extend((kind, len(points)//3, 2, screen_space, color.r, color.g, color.b, thickness))
+        if screen_space:
+            points.extend((start[0], start[1], 0, end[0], end[1], 0))
+        else:
+            points.extend(start)
+            points.extend(end)
+    
+    def add_lines(self, points:np.ndarray, color, thickness:int=1) -> None:
+        color = pygame.Color(color)
+        self._commands.extend((DebugBuffer.LINES, len(self._points)//3, len(points), False, color.r, color.g, color.b, thickness))
+        self._points.extend(points.ravel().tolist())
+    
+    def clear(self) -> None:
+        self._points.clear()
+        self._commands.clear()
+    
+    @staticmethod
+    def rect_outline(a, b, thickness:int) -> list:
+        """
+        Polyline drawing the same pixels as pygame.draw.rect with this border thickness:
+        one ring per pixel of thickness, each ring starting diagonally next to the previous one
+        """
+        # pygame.Rect truncates position and size separately
+        rect = pygame.Rect(a[0], a[1], b[0]-a[0], b[1]-a[1])
+        if rect.width<=0 or rect.height<=0: return []
+        x0, y0, x1, y1 = rect.left, rect.top, rect.right-1, rect.bottom-1
+        line = []
+        for k in range(max(1, thickness)):
+            if x0+k>x1-k or y0+k>y1-k: break
+            line += [(x0+k, y0+k), (x1-k, y0+k), (x1-k, y1-k), (x0+k, y1-k), (x0+k, y0+k)]
+        return line
+    
+    def flush(self, screen:pygame.Surface, camera:'Camera') -> None:
+        """
+        Polylines of the same (color, thickness, space) are drawn together, following each other
+        are chained into a single pygame.draw.lines call: pygame.draw.lines only draws connected points.
+        """
+        if not self._commands: return
+        world = np.array(self._points, dtype=np.float64).reshape(-1, 3)
+        commands = np.array(self._commands, dtype=np.float64).reshape(-1, 8)
+        self.clear()
+        kinds = commands[:, 0].astype(np.int32)
+        starts = commands[:, 1].astype(np.int32)
+        counts = commands[:, 2].astype(np.int32)
+        projected = camera.world_to_screen_many(world)
+        screen_space = np.repeat(commands[:, 3]!=0, counts)
+        if screen_space.any():
+            projected[screen_space] = world[screen_space, :2]
+        
+        # Arrow heads of every vector: 30% of the on-screen length, 20 degrees off the shaft
+        vectors = np.flatnonzero(kinds==DebugBuffer.VECTOR)
+        tips = projected[starts[vectors]+1].astype(np.float64)
+        back = projected[starts[vectors]]-tips
+        c, s = math.cos(math.radians(20)), math.sin(math.radians(20))
+        head_l = tips+0.3*np.stack((back[:, 0]*c-back[:, 1]*s, back[:, 0]*s+back[:, 1]*c), axis=1)
+        head_r = tips+0.3*np.stack((back[:, 0]*c+back[:, 1]*s, -back[:, 0]*s+back[:, 1]*c), axis=1)
+        heads = dict(zip(vectors.tolist(), zip(head_l.tolist(), head_r.tolist())))
+        
+        points = projected.tolist()
+        corners = world[:, :2].tolist()
+        styles = commands[:, 3:8].astype(np.int32).tolist()     # screen space, r, g, b, thickness
+        groups:dict[tuple, list[list]] = {}
+        for i, kind, start, count, style in zip(range(len(kinds)), kinds.tolist(), starts.tolist(), counts.tolist(), styles):
+            space, r, g, b, thickness = style
+            if kind==DebugBuffer.LINES:
+                line = points[start:start+count]
+            elif kind==DebugBuffer.VECTOR:
+                tail, tip = points[start], points[start+1]
+                if tail==tip: continue
+                left, right = heads[i]
+                line = [tail, tip, left, tip, right]
+                thickness = 1
+            else:
+                # Screen space rectangles keep their float corners
+                line = DebugBuffer.rect_outline(*((corners[start], corners[start+1]) if space else (points[start], points[start+1])), thickness)
+                if not line: continue
+                thickness = 1
+            group = groups.get((r, g, b, thickness, space))
+            if group is None:
+                groups[(r, g, b, thickness, space)] = [line]
+            elif group[-1][-1]==line[0]:
+                group[-1] = group[-1]+line[1:]
+            else:
+                group.append(line)
+        
+        for (r, g, b, thickness, _), lines in groups.items():
+            for line in lines:
+                pygame.draw.lines(screen, (r, g, b), False, line, thickness)
+
+class DrawableGrid:
+    """
+    Uniform grid of drawable world bounds. Drawables are bucketed in every cell they cover
+    and only re-bucketed when the range of cells they cover changes.
+    Moved drawables mark themselves, refresh() re-buckets only those.
+    Drawables covering more than max_cells cells are kept in a list returned by every query.
+    """
+    def __init__(self, cell_size:float=4., max_cells:int=64) -> None:
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self._cells:dict[tuple[int, int], set[DrawableComponent]] = {}
+        self._ranges:dict[DrawableComponent, tuple[int, int, int, int]] = {}
+        self._oversize:set[DrawableComponent] = set()
+        self._moved:set[DrawableComponent] = set()
+    
+    def __len__(self) -> int:
+        return len(self._ranges)
+    
+    def _cell_range(self, bounds:Tuple[float, float, float, float]) -> tuple[int, int, int, int]:
+        inv = 1/self.cell_size
+        return math.floor(bounds[0]*inv), math.floor(bounds[1]*inv), math.floor(bounds[2]*inv), math.floor(bounds[3]*inv)
+    
+    def update(self, drawable:DrawableComponent) -> None:
+        drawable._grid = self
+        cells = self._cell_range(drawable.get_world_bounds())
+        previous = self._ranges.get(drawable)
+        if previous==cells: return
+        if previous: self._unlink(drawable, previous)
+        self._ranges[drawable] = cells
+        x0, y0, x1, y1 = cells
+        if (x1-x0+1)*(y1-y0+1)>self.max_cells:
+            self._oversize.add(drawable)
+            return
+        for cx in range(x0, x1+1):
+            for cy in range(y0, y1+1):
+                bucket = self._cells.get((cx, cy))
+                if bucket is None:
+                    self._cells[(cx, cy)] = {drawable}
+                else:
+                    bucket.add(drawable)
+    
+    def mark(self, drawable:DrawableComponent) -> None:
+        self._moved.add(drawable)
+    
+    def refresh(self) -> None:
+        """
+        Re-buckets the drawables marked since the last call
+        """
+        for drawable in self._moved:
+            if drawable in self._ranges: self.update(drawable)
+        self._moved.clear()
+    
+    def remove(self, drawable:DrawableComponent) -> None:
+        cells = self._ranges.pop(drawable, None)
+        if cells: self._unlink(drawable, cells)
+        self._moved.discard(drawable)
+        drawable._grid = None
+    
+    def _unlink(self, drawable:DrawableComponent, cells:tuple[int, int, int, int]) -> None:
+        if drawable in self._oversize:
+            self._oversize.discard(drawable)
+            return
+        x0, y0, x1, y1 = cells
+        for cx in range(x0, x1+1):
+            for cy in range(y0, y1+1):
+                bucket = self._cells[(cx, cy)]
+                bucket.discard(drawable)
+                if not bucket: del self._cells[(cx, cy)]
+    
+    def query(self, xmin:float, ymin:float, xmax:float, ymax:float) -> set[DrawableComponent]:
+        """
+        Drawables in the cells touching the rectangle, a superset of the ones overlapping it
+        """
+        x0, y0, x1, y1 = self._cell_range((xmin, ymin, xmax, ymax))
+        found:set[DrawableComponent] = set(self._oversize)
+        cells = self._cells
+        if (x1-x0+1)*(y1-y0+1)>len(cells):
+            for (cx, cy), bucket in cells.items():
+                if x0<=cx<=x1 and y0<=cy<=y1: found |= bucket
+            return found
+        for cx in range(x0, x1+1):
+            for cy in range(y0, y1+1):
+                bucket = cells.get((cx, cy))
+                if bucket: found |= bucket
+        return found
+
 
 class Scene:
     def __init__(self):
         self._objects : List[SceneComponent] = []
         self.manual_rendering : bool = False
         self.active_camera : Camera = OrthographicCamera() # type: ignore
-        self._drawables : SortedList = SortedList()
+        self._drawables : list[DrawableComponent] = []     # In the order of the last depth sort
+        self._drawable_grid = DrawableGrid()
+        self.drawables_culled = 0
         self._tilemaps : list[Tilemap] = []
         self._tilesets : list[Tileset] = []
-        self._backgrounds : list[SpriteComponent] = []
+        self._backgrounds : list[DrawableComponent] = []
         self._ambient_light = vec3(1., 1., 1.)*0.5
         self._lights : list[Light] = []
         self._lightmap : pygame.Surface = pygame.surface.Surface(vec2(10, 10))
+        self._upscaled_lightmap : pygame.Surface|None = None
+        self.lightmap_scale : int = 1       # 2 or 4 render the lightmap at 1/2 or 1/4 of the window resolution
+        self.lightmap_smooth : bool = True  # Upscale with smoothscale, nearest neighbour is cheaper but blocky
+        self.lights_drawn = 0
+        self.lights_culled = 0
     
     def add_drawable_rec(self, obj : SceneComponent):
         if issubclass(type(obj), DrawableComponent):
-            self._drawables.add(obj)
+            _update_depth(obj)
+            obj._order = len(self._drawables)
+            self._drawables.append(obj)
+            self._drawable_grid.update(obj)
         if obj.any_child():
             for child in obj.children:
                 if issubclass(type(child), SceneComponent):
@@ -1075,26 +2029,82 @@ class Scene:
         for light in self._lights:
                 light.render()
     
+    def sort_drawables(self) -> list[DrawableComponent]:
+        """
+        Drawables in drawing order. The list keeps the order of the previous frame,
+        which is nearly sorted: Timsort's run detection makes re-sorting it close to O(n).
+        Equal depths are ordered by registration, so overlapping drawables don't flicker.
+        Static drawables reuse the depth computed when they were registered.
+        """
+        self._drawables.sort(key=_draw_key)
+        return self._drawables
+    
+    def project_drawables(self, drawables:list[DrawableComponent]) -> None:
+        """
+        Projects the world position of every drawable at once, each one uses it in its next draw
+        """
+        if not drawables: return
+        positions = np.fromiter((c for obj in drawables for c in obj.get_world_position()), dtype=np.float64, count=3*len(drawables))
+        points = Globals.game.camera.world_to_screen_many(positions.reshape(-1, 3)).tolist()
+        for obj, point in zip(drawables, points):
+            obj._screen_pos = point
+    
+    @profiler.profile("Scene.draw")
     def draw(self):
         if not self.manual_rendering:
             for background in self._backgrounds:
                 background.draw()
-            for obj in self._drawables:
-                obj.draw()
+            camera = Globals.game.camera
+            if hasattr(camera, "get_view_bounds"):
+                # Only the drawables in view are sorted and drawn, the others are not touched
+                grid = self._drawable_grid
+                grid.refresh()
+                shown = sorted(grid.query(*camera.get_view_bounds()), key=_draw_key)
+                self.project_drawables(shown)
+                for obj in shown:
+                    obj.draw()
+                culled = len(self._drawables)-len(shown)
+                self.drawables_culled = culled
+                Globals.game.debug_infos["drawables"] = "{} drawn, {} culled".format(len(shown), culled)
+            else:
+                for obj in self.sort_drawables():
+                    obj.draw()
+            Globals.game.render_queue.flush(Globals.game.screen)
     
     def set_ambient_light(self, val:vec3):
         self._ambient_light = val
         return self
     
+    @profiler.profile("Scene.light_pass")
     def light_pass(self):
-        if self._lightmap.get_size()!=Globals.game.size:
-            self._lightmap = pygame.surface.Surface(Globals.game.size)
+        # The lightmap is multiplied over everything drawn before it
+        Globals.game.render_queue.flush(Globals.game.screen)
+        scale = self.lightmap_scale
+        size = Globals.game.size
+        lightmap_size = (max(1, size[0]//scale), max(1, size[1]//scale))
+        if self._lightmap.get_size()!=lightmap_size:
+            self._lightmap = pygame.surface.Surface(lightmap_size)
         self._lightmap.fill(color_from_vec3(self._ambient_light*255))
         if not self.manual_rendering:
+            view = pygame.Rect((0, 0), size)
+            drawn = culled = 0
             for light in self._lights:
+                rect = light.get_screen_rect()
+                if rect is not None and not view.colliderect(rect):
+                    culled += 1
+                    continue
                 light.draw()
+                drawn += 1
+            self.lights_drawn, self.lights_culled = drawn, culled
+            Globals.game.debug_infos["lights"] = "{} drawn, {} culled".format(drawn, culled)
             
-            Globals.game.screen.blit(self._lightmap, (0, 0), special_flags=pygame.BLEND_MULT)
+            lightmap = self._lightmap
+            if scale!=1:
+                if self._upscaled_lightmap is None or self._upscaled_lightmap.get_size()!=tuple(size):
+                    self._upscaled_lightmap = pygame.surface.Surface(size)
+                upscale = pygame.transform.smoothscale if self.lightmap_smooth else pygame.transform.scale
+                lightmap = upscale(self._lightmap, size, self._upscaled_lightmap)
+            Globals.game.screen.blit(lightmap, (0, 0), special_flags=pygame.BLEND_MULT)
     
     def update(self):
         for obj in self._objects:
@@ -1104,7 +2114,12 @@ class Scene:
         self._backgrounds.clear()
     
 
-    def load_map(self, name:str, path:str) -> list['SpriteComponent']:
+    def load_map(self, name:str, path:str) -> list['TilemapComponent']:
+        cache = MapCache(Globals.game.map_cache_dir, path) if Globals.game.map_cache_dir else None
+        if cache and cache.is_valid():
+            log("Loading map from cache {}".format(cache.dir))
+            return self._load_cached_map(name, cache)
+        
         sprites = []
         data = None
         with open(path) as f:
@@ -1116,10 +2131,13 @@ class Scene:
         i=0
         tw = data["tilewidth"]
         th = data["tileheight"]
+        sources = [path]
         for tileset in d_tilesets:
-            ts = Tileset(name+"_"+str(i), replace_extension(tileset["source"], "png"), int(data["tilewidth"]), int(data["tileheight"]))
+            source = replace_extension(tileset["source"], "png")
+            ts = Tileset(name+"_"+str(i), source, int(data["tilewidth"]), int(data["tileheight"]))
             ts._start_index = tileset["firstgid"]
             self._tilesets.append(ts)
+            sources.append(self.resource_path(source))
             i+=1
         
         for layer in d_layers:
@@ -1130,19 +2148,51 @@ class Scene:
             map = map.reshape(height, width)
             tm = Tilemap(name, self._tilesets, size, vec2(tw, th))
             tm.map = map
-            tm.compute()
             self._tilemaps.append(tm)
-            map_sprite = SpriteComponent(None, vec3(2, 2, 0), vec2(0, 0))
+            # Chunks are rendered when they first come into view
+            map_sprite = TilemapComponent(tm, None, vec3(2, 2, 0))
             map_sprite.size = vec3(tm.width*2, tm.height*2, 0)
-            map_sprite.sprite = tm.image
-            map_sprite._size_locked = True
             sprites.append(map_sprite)
             self._backgrounds.append(map_sprite)
         
+        if cache:
+            cache.store(sources, [sprite.tilemap for sprite in sprites])
+            # Chunks are then read back from the memory mapped cache files instead of rendered again
+            for i, sprite in enumerate(sprites):
+                sprite.prerendered = cache.load_render(i)
+        
+        return sprites
+    
+    def _load_cached_map(self, name:str, cache:MapCache) -> list['TilemapComponent']:
+        sprites = []
+        tw, th = cache.manifest["tile_size"]
+        for i, map in enumerate(cache.load_layers()):
+            height, width = map.shape
+            tm = Tilemap(name, [], vec2(width, height), vec2(tw, th))
+            tm.map = map
+            self._tilemaps.append(tm)
+            map_sprite = TilemapComponent(tm, None, vec3(2, 2, 0))
+            map_sprite.size = vec3(tm.width*2, tm.height*2, 0)
+            map_sprite.prerendered = cache.load_render(i)
+            sprites.append(map_sprite)
+            self._backgrounds.append(map_sprite)
         return sprites
     
+    @staticmethod
+    def resource_path(path:str) -> str:
+        return Globals.game.resource_path(path)
+    
     def get_light_map(self) -> pygame.Surface:
         return self._lightmap
+    
+    def set_lightmap_scale(self, scale:int, smooth:bool=True):
+        """
+        Renders the lightmap at 1/scale of the window resolution, upscaled before the multiply
+        """
+        assert scale in (1, 2, 4)
+        self.lightmap_scale = scale
+        self.lightmap_smooth = smooth
+        return self
 
 class Level:
     def __init__(self) -> None:
@@ -1179,12 +2229,13 @@ class PhysicsWorld:
         self._particle_systems.append(obj)
         # obj.world = self
 
+    @profiler.profile("PhysicsWorld.tick")
     def tick(self):
         self.tmp_tick=time.time_ns()
         dt = (self.tmp_tick-self.last_tick)*1.0E-9
         self.last_tick=self.tmp_tick
-        if self._draw_borders and self.limits[0].length_squared()<math.inf and self.limits[1].length_squared()<math.inf:
-            Globals.game.draw_debug_box(set_z(self.limits[0], 0), set_z(self.limits[1], 0), vec3(255, 0, 0), thickness=2)
+        if self._draw_borders and Globals.game.debug_active("world") and self.limits[0].length_squared()<math.inf and self.limits[1].length_squared()<math.inf:
+            Globals.game.draw_debug_box(set_z(self.limits[0], 0), set_z(self.limits[1], 0), vec3(255, 0, 0), thickness=2, category="world")
         
         for obj in self.objects:
             obj.tick(dt)
@@ -1290,6 +2341,7 @@ class PhysicsComponent(DrawableComponent, SceneComponent):
     @SceneComponent.size.setter
     def size(self, s):
         self._size = s
+        self.invalidate_bounds()
         self._bounding_box = BoundingBox(self._pos-self.size/2, self._pos+self.size/2)
     
     def set_size(self, size:vec3):
@@ -1298,22 +2350,22 @@ class PhysicsComponent(DrawableComponent, SceneComponent):
         return self
 
     def draw(self):
-        Globals.game.draw_debug_rectangle(Globals.game.camera.world_to_screen(set_z(self._bounding_box._begin, 0)),
-                                        Globals.game.camera.world_to_screen(set_z(self._bounding_box._end, 0)), color=vec3(255, 150, 0), thickness=1)
-        pass
+        if Globals.game.debug_active("physics"):
+            Globals.game.draw_debug_box(set_z(self._bounding_box._begin, 0), set_z(self._bounding_box._end, 0), color=vec3(255, 150, 0), thickness=1, category="physics")
     
     def tick(self, dt:float):
         if not self.simulate_physics: return
         
+        debug = Globals.game.debug_active("physics")
         self.acc = vec3()
         for f in self.forces:
             force = f.get(self)
             self.acc += force
-            Globals.game.draw_debug_vector(self._pos, self._pos+0.1*force)
+            if debug: Globals.game.draw_debug_vector(self._pos, self._pos+0.1*force, category="physics")
         for f in self.one_forces:
             force = f.get(self)
             self.acc += force
-            Globals.game.draw_debug_vector(self._pos, self._pos+0.1*force, (0,0,255))
+            if debug: Globals.game.draw_debug_vector(self._pos, self._pos+0.1*force, (0,0,255), category="physics")
         self.one_forces = []
         self.acc /= self.mass
         # log("Accélération : {}".format(self.acc))
@@ -1363,10 +2415,14 @@ class PhysicsComponent(DrawableComponent, SceneComponent):
                 self.vel.z = 0
                 self._pos.z = self.world.limits[1].z
         
-        Globals.game.draw_debug_vector(self._pos, self._pos+0.1*self.vel, (10,255,10))
+        if vel.x or vel.y or vel.z:
+            self.invalidate()
+        if debug: Globals.game.draw_debug_vector(self._pos, self._pos+0.1*self.vel, (10,255,10), category="physics")
         # Globals.game.draw_debug_box(self._pos-set_z(self.size/2, 0), self._pos+set_z(self.size/2, 0), (0, 0, 255), thickness=1)
 
 class SpriteComponent(DrawableComponent):
+    zoom_steps = 8      # Scaled variants per octave of camera zoom
+    
     def __init__(self, parent, pos=vec3(), size=vec2(1, 1), image_name="default"):
         SceneComponent.__init__(self, parent=parent, pos=pos)
         Drawable.__init__(self)
@@ -1374,25 +2430,143 @@ class SpriteComponent(DrawableComponent):
         self.sprite = Globals.game.load_image(image_name, size=self.draw_size)
         self._size_locked = False
         self._draw_offset = vec2()
+        self.render_layer = 1
+        self.exact_size = False     # Hero sprites: the nearest zoom level is rescaled to the exact size every frame
+        self._level_key = None      # Image name and draw size the current zoom level was picked for
     
     def draw(self):
         Drawable.draw(self)
         if self.sprite:
-            draw_pos = Globals.game.camera.world_to_screen(self.get_world_position())
+            draw_pos = self._screen_pos
+            if draw_pos is None:
+                draw_pos = Globals.game.camera.world_to_screen(self.get_world_position())
+            self._screen_pos = None
             self.draw_size = Globals.game.camera.world_size2_to_screen(self.size.xy)
-            Globals.game.draw_debug_box(self.get_world_position()-self.size/2, self.get_world_position()+self.size/2, (0, 255, 100))
-            if self.sprite.size!=self.draw_size:
-                if (not self._size_locked):
-                    # log("Size if wrong, reloading sprite", logTypes.warning)
-                    self.sprite = Globals.game.load_image(self.sprite.name, self.sprite.path, self.draw_size)
-                else:
-                    self.sprite.resize(self.draw_size)
-            Globals.game.screen.blit(self.sprite.get_data(), draw_pos - self.draw_size.xy/2 + self._draw_offset)
+            if Globals.game.debug_active("sprites"):
+                Globals.game.draw_debug_box(self.get_world_position()-self.size/2, self.get_world_position()+self.size/2, (0, 255, 100), category="sprites")
+            if (not self._size_locked):
+                key = (self.sprite.name, self.draw_size.x, self.draw_size.y)
+                if key!=self._level_key:
+                    self.sprite = Globals.game.load_image_level(self.sprite.name, self.draw_size, self.zoom_steps, self.sprite.path)
+                    self._level_key = key
+            elif self.sprite.size!=self.draw_size:
+                self.sprite = self.sprite.resized(self.draw_size)
+            surface = self.sprite.get_data()
+            size = (max(1, int(self.draw_size.x)), max(1, int(self.draw_size.y)))
+            if self.exact_size and surface.get_size()!=size:
+                surface = pygame.transform.scale(surface, size)
+            w, h = surface.get_size()
+            dest = (draw_pos[0]-w/2+self._draw_offset.x, draw_pos[1]-h/2+self._draw_offset.y)
+            Globals.game.render_queue.submit(surface, dest, layer=self.render_layer)
+    
+    def get_world_bounds(self) -> Tuple[float, float, float, float]:
+        xmin, ymin, xmax, ymax = DrawableComponent.get_world_bounds(self)
+        camera = Globals.game.camera
+        if (self._draw_offset.x or self._draw_offset.y) and hasattr(camera, "screen_size"):
+            # The draw offset is in pixels
+            dx = self._draw_offset.x*camera.bounds.x/camera.screen_size.x
+            dy = self._draw_offset.y*camera.bounds.y/camera.screen_size.y
+            xmin, ymin, xmax, ymax = xmin+dx, ymin+dy, xmax+dx, ymax+dy
+        return xmin, ymin, xmax, ymax
     
     def set_draw_offset(self, offset:vec2):
         self._draw_offset = offset
 
 
+class TilemapComponent(DrawableComponent):
+    """
+    Draws a tilemap chunk by chunk. Chunks are rendered on first view, 
+    cached per zoom level and skipped when outside of the camera view.
+    Covers size.x by size.y world units, centered on its position.
+    While the camera zooms, chunks are scaled to zoom_steps levels per octave like sprites,
+    they are scaled to the exact zoom once it stops changing.
+    """
+    zoom_steps = 8
+    
+    def __init__(self, tilemap:Tilemap, parent=None, pos=vec3(), max_zoom_levels:int=2):
+        DrawableComponent.__init__(self, parent, pos)
+        self._tilemap = tilemap
+        self._size = vec3(tilemap.width, tilemap.height, 0)
+        self._chunks:dict[tuple[int, int], pygame.Surface] = {}
+        self._scaled:OrderedDict[tuple[int, int], dict[tuple[int, int], pygame.Surface]] = OrderedDict()   # zoom: chunk: surface
+        self.max_zoom_levels = max_zoom_levels
+        self.render_layer = 0
+        self.prerendered:pygame.Surface|None = None     # Whole map at tileset resolution, chunks are taken from it when set
+        self.visible_chunks = 0
+        self._last_zoom:tuple[float, float]|None = None     # Exact chunk size in pixels at the previous draw
+    
+    @property
+    def tilemap(self) -> Tilemap:
+        return self._tilemap
+    
+    def get_chunk(self, row:int, col:int) -> pygame.Surface:
+        chunk = self._chunks.get((row, col))
+        if chunk is None:
+            if self.prerendered:
+                cs = self._tilemap.chunk_size
+                tw, th = int(self._tilemap._sx), int(self._tilemap._sy)
+                chunk = self.prerendered.subsurface(pygame.Rect(col*cs*tw, row*cs*th, cs*tw, cs*th).clip(self.prerendered.get_rect()))
+            else:
+                chunk = self._tilemap.render_chunk(row, col)
+            self._chunks[(row, col)] = chunk
+        return chunk
+    
+    def _zoom_cache(self, zoom:tuple[int, int]) -> dict[tuple[int, int], pygame.Surface]:
+        cache = self._scaled.get(zoom)
+        if cache is None:
+            cache = self._scaled[zoom] = {}
+            while len(self._scaled)>self.max_zoom_levels:
+                self._scaled.popitem(last=False)
+        else:
+            self._scaled.move_to_end(zoom)
+        return cache
+    
+    def draw(self):
+        Drawable.draw(self)
+        camera:OrthographicCamera = Globals.game.camera # type: ignore
+        if not hasattr(camera, "get_view_bounds"):
+            return      # Chunks are culled and scaled from the view rectangle of an orthographic camera
+        tm = self._tilemap
+        cs = tm.chunk_size
+        rows, cols = tm.chunk_count
+        m, n = tm.map.shape
+        
+        tile_w = self.size.x/n
+        tile_h = self.size.y/m
+        chunk_w, chunk_h = tile_w*cs, tile_h*cs
+        center = self.get_world_position()
+        ox, oy = center.x-self.size.x/2, center.y-self.size.y/2
+        
+        xmin, ymin, xmax, ymax = camera.get_view_bounds()
+        c0, c1 = max(0, math.floor((xmin-ox)/chunk_w)), min(cols-1, math.floor((xmax-ox)/chunk_w))
+        r0, r1 = max(0, math.floor((ymin-oy)/chunk_h)), min(rows-1, math.floor((ymax-oy)/chunk_h))
+        
+        # Chunk sizes are rounded up, so that neighbouring chunks overlap instead of leaving seams
+        exact = (chunk_w*camera.screen_size.x/camera.bounds.x, chunk_h*camera.screen_size.y/camera.bounds.y)
+        if exact[0]<=0 or exact[1]<=0: return
+        if exact==self._last_zoom:
+            zoom = (math.ceil(exact[0]), math.ceil(exact[1]))
+        else:
+            zoom = quantize_image_size((int(cs*tm._sx), int(cs*tm._sy)), exact, self.zoom_steps, up=True)
+        self._last_zoom = exact
+        cache = self._zoom_cache(zoom)
+        queue = Globals.game.render_queue
+        self.visible_chunks = 0
+        for r in range(r0, r1+1):
+            for c in range(c0, c1+1):
+                surface = cache.get((r, c))
+                if surface is None:
+                    # Last row and column chunks can be partial
+                    size = (math.ceil(zoom[0]*(min((c+1)*cs, n)-c*cs)/cs), math.ceil(zoom[1]*(min((r+1)*cs, m)-r*cs)/cs))
+                    surface = pygame.transform.scale(self.get_chunk(r, c), size)
+                    if pygame.display.get_surface() is not None:
+                        surface = surface.convert_alpha()
+                    cache[(r, c)] = surface
+                tl = camera.world_to_screen(vec3(ox+c*chunk_w, oy+r*chunk_h, 0))
+                queue.submit(surface, tl, layer=self.render_layer)
+                self.visible_chunks += 1
+
+
 class Actor(Object):
     def __init__(self, pos=vec3()):
         Object.__init__(self)
@@ -1415,7 +2589,8 @@ class Pawn(Actor):
         self.character = SpriteComponent(self.root, image_name=image_name)
     
     def update(self):        
-        self.shadow._pos = vec3(self.root.get_world_position().x, self.root.get_world_position().y, Globals.world.line_trace(self.root.get_local_position(), vec3(0, 0, -1)).z)
+        root = self.root.get_world_position()
+        self.shadow.set_local_position(vec3(root.x, root.y, Globals.world.line_trace(self.root.get_local_position(), vec3(0, 0, -1)).z))
 
 
 def testSlimyEngine():
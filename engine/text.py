@@ -0,0 +1,145 @@
+import string
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+import pygame
+
+
+# Characters of fast changing text (fps, clocks, scores, counters)
+DEFAULT_GLYPHS = string.digits + string.punctuation + " "
+
+
+def _color_key(color) -> tuple:
+    return tuple(color)
+
+
+class TextCache:
+    """
+    LRU cache of rendered strings, keyed by (font, text, color, antialias)
+    """
+    def __init__(self, max_entries:int=256) -> None:
+        self.max_entries = max_entries
+        self._surfaces:OrderedDict[tuple, pygame.Surface] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._surfaces)
+
+    def render(self, font:pygame.font.Font, text:str, antialias:bool, color) -> pygame.Surface:
+        key = (font, text, _color_key(color), antialias)
+        surface = self._surfaces.get(key)
+        if surface is not None:
+            self._surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        surface = font.render(text, antialias, color)
+        self._surfaces[key] = surface
+        if len(self._surfaces) > self.max_entries:
+            self._surfaces.popitem(last=False)
+            self.evictions += 1
+        return surface
+
+    def clear(self) -> None:
+        self._surfaces.clear()
+
+
+class GlyphAtlas:
+    """
+    Glyphs of one font/color pre-rendered side by side in a single surface.
+    Strings made of these glyphs are drawn with one Surface.blits call, without calling into the font.
+    Kerning is lost, which is fine for digits and punctuation.
+    """
+    def __init__(self, font:pygame.font.Font, color, antialias:bool=True, glyphs:str=DEFAULT_GLYPHS) -> None:
+        self.height = font.get_height()
+        self._glyphs:Dict[str, Tuple[pygame.Rect, int]] = {}   # char: area in the atlas, advance
+
+        rendered = []
+        width = 0
+        for char in glyphs:
+            surface = font.render(char, antialias, color)
+            rendered.append((char, surface, width))
+            width += surface.get_width()
+
+        self.surface = pygame.Surface((max(width, 1), self.height), pygame.SRCALPHA)
+        for char, surface, x in rendered:
+            self.surface.blit(surface, (x, 0))
+            metrics = font.metrics(char)[0]
+            advance = metrics[4] if metrics else surface.get_width()
+            self._glyphs[char] = (pygame.Rect(x, 0, surface.get_width(), self.height), advance)
+        if pygame.display.get_surface() is not None:
+            self.surface = self.surface.convert_alpha()
+
+    def can_render(self, text:str) -> bool:
+        glyphs = self._glyphs
+        for char in text:
+            if char not in glyphs:
+                return False
+        return True
+
+    def size(self, text:str) -> Tuple[int, int]:
+        glyphs = self._glyphs
+        return sum(glyphs[char][1] for char in text), self.height
+
+    def draw(self, surface:pygame.Surface, text:str, pos) -> pygame.Rect:
+        x, y = int(pos[0]), int(pos[1])
+        start = x
+        blits = []
+        for char in text:
+            area, advance = self._glyphs[char]
+            blits.append((self.surface, (x, y), area))
+            x += advance
+        surface.blits(blits, doreturn=False)
+        return pygame.Rect(start, y, x-start, self.height)
+
+
+class TextRenderer:
+    """
+    Draws text through a glyph atlas when every character is in it, through the string cache otherwise.
+    Atlases are kept in LRU order too, keyed by (font, color, antialias).
+    """
+    def __init__(self, max_entries:int=256, glyphs:str=DEFAULT_GLYPHS, max_atlases:int=16) -> None:
+        self.cache = TextCache(max_entries)
+        self.glyphs = glyphs
+        self.max_atlases = max_atlases
+        self._atlases:OrderedDict[tuple, GlyphAtlas] = OrderedDict()
+        self.atlas_evictions = 0
+
+    def get_atlas(self, font:pygame.font.Font, color, antialias:bool=True) -> GlyphAtlas:
+        key = (font, _color_key(color), antialias)
+        atlas = self._atlases.get(key)
+        if atlas is not None:
+            self._atlases.move_to_end(key)
+            return atlas
+
+        atlas = GlyphAtlas(font, color, antialias, self.glyphs)
+        self._atlases[key] = atlas
+        if len(self._atlases) > self.max_atlases:
+            self._atlases.popitem(last=False)
+            self.atlas_evictions += 1
+        return atlas
+
+    def render(self, font:pygame.font.Font, text:str, antialias:bool, color) -> pygame.Surface:
+        return self.cache.render(font, text, antialias, color)
+
+    def size(self, font:pygame.font.Font, text:str, color, antialias:bool=True) -> Tuple[int, int]:
+        atlas = self.get_atlas(font, color, antialias)
+        if atlas.can_render(text):
+            return atlas.size(text)
+        return self.cache.render(font, text, antialias, color).get_size()
+
+    def draw(self, surface:pygame.Surface, font:pygame.font.Font, text:str, pos, color, antialias:bool=True) -> pygame.Rect:
+        atlas = self.get_atlas(font, color, antialias)
+        if atlas.can_render(text):
+            return atlas.draw(surface, text, pos)
+        return surface.blit(self.cache.render(font, text, antialias, color), pos)
+
+    def clear(self) -> None:
+        self.cache.clear()
+        self._atlases.clear()
+
+
+text_renderer = TextRenderer()
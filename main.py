@@ -1,8 +1,15 @@
+import os
 import sys
+import time
 import pygame as pg
 from typing import *
 import random
 import math
+import numpy as np
+
+from engine.profiler import profiler
+from engine.text import text_renderer
+from engine.assets import AssetManifest, AssetPreloader
 
 Vec2 = pg.math.Vector2
 Vec3 = pg.math.Vector3
@@ -74,8 +81,8 @@ def draw_text(screen, text, pos=(0,0), color=None, **flags):
     for k in flags:
         if k == "antialias": antialias = flags[k]
     
-    textsurface = Globals.game.font.render(text, antialias, color)  # "text", antialias, color
-    screen.blit(textsurface, pos)
+    # Cached, or composed from a glyph atlas for numbers
+    return text_renderer.draw(screen, Globals.game.font, text, pos, color, antialias)
 
 
 class Colors:
@@ -87,11 +94,13 @@ class Colors:
     CYAN = (0, 255, 255)
     BLUE = (0, 0, 255)
     MAGENTA = (255, 0, 255)
+    WATER = hex_to_rgb(0x0095e9)
 
 
 class Constants:
     DEFAULT_FRICTION = 5
     DEFAULT_MOVEMENT_FORCE = 3000
+    COLLISION_CELL_SIZE = 128
 
 
 class Globals:
@@ -99,11 +108,18 @@ class Globals:
      
      
 class Image:
+    _surfaces: Dict[tuple, pg.Surface] = {}     ## (path, size): decoded surface, shared by every Image
+    
     def __init__(self, path:str, size=None) -> None:
         self.path = path
-        self._image = pg.image.load(path)
-        if size:
-            self._image = pg.transform.scale(self._image, size)
+        key = (path, tuple(size) if size else None)
+        self._image = Image._surfaces.get(key)
+        if self._image is None:
+            self._image = Image._surfaces.get((path, None))
+            if self._image is None:
+                self._image = Image._surfaces[(path, None)] = pg.image.load(path)
+            if size:
+                self._image = Image._surfaces[key] = pg.transform.scale(self._image, size)
         
         self.size = self.width, self.height = self._image.get_size()
     
@@ -215,27 +231,47 @@ class ImageRenderer:
 
     def render(self, screen, actor):
         if self.image:            
-            x = actor.pos.x - self.image.width/2
-            y = actor.pos.y - self.image.height/2 
+            pos = actor.render_pos
+            x = pos.x - self.image.width/2
+            y = pos.y - self.image.height/2 
             
             if self.shadow:# and actor.pos.z >= 0:
-                pg.draw.circle(screen, (0,0,0, 125), to_vec2(actor.pos), actor.collision.radius)
+                pg.draw.circle(screen, (0,0,0, 125), to_vec2(pos), actor.collision.radius)
             
-            self.image.draw(screen, x, y - actor.pos.z)
+            self.image.draw(screen, x, y - pos.z)
             
             # if self.shadow and actor.pos.z < 0:
             #     pg.draw.circle(screen, (0,0,0, 125), to_vec2(actor.pos), actor.collision.radius)
 
+    def get_rect(self, actor) -> pg.Rect|None:
+        """
+        Screen area covered by render(), sprite and shadow included
+        """
+        if not self.image:
+            return None
+        
+        pos = actor.render_pos
+        rect = pg.Rect(pos.x - self.image.width/2, pos.y - self.image.height/2 - pos.z, self.image.width, self.image.height)
+        if self.shadow:
+            r = actor.collision.radius
+            rect.union_ip(pg.Rect(pos.x - r, pos.y - r, 2*r, 2*r))
+        return rect.inflate(2, 2)
+
 
 class Actor(Object):
     """
     Object with a position, velocity and subject to forces.
+    When bound to a VectorizedIntegrator, see BoundActor.
     """
     def __init__(self, x=0, y=0, z=0) -> None:
         super().__init__()
+        self._integrator: 'VectorizedIntegrator|None' = None
+        self._index = -1
+        
         self.pos: Vec3 = Vec3(x, y, z)
         self.vel: Vec3 = Vec3(0, 0, 0)
         self.acc: Vec3 = Vec3(0, 0, 0)
+        self.prev_pos: Vec3 = Vec3(x, y, z)   ## Position at the previous simulation tick
 
         self.friction = Constants.DEFAULT_FRICTION
         self._forces: List[Vec3] = []
@@ -247,7 +283,25 @@ class Actor(Object):
         
         self.renderer = ImageRenderer()
     
+    @property
+    def render_pos(self) -> Vec3:
+        """
+        Position to draw the actor at, interpolated between the last two 
+        simulation ticks when the game runs with a fixed timestep
+        """
+        game = Globals.game
+        if game and game.fixed_timestep:
+            return self.prev_pos.lerp(self.pos, game.interpolation)
+        return self.pos
+    
+    def save_state(self) -> None:
+        self.prev_pos = Vec3(self.pos)
+    
     def update(self, dt: float) -> None:
+        # Integration is done for all actors at once by the integrator
+        if self._integrator is not None:
+            return
+        
         self.apply_force(self.gravity_force)
         
         # Buoyancy on water
@@ -268,12 +322,22 @@ class Actor(Object):
         
     def draw(self, screen: pg.Surface) -> None:
         self.renderer.render(screen, self)
+    
+    def get_draw_rect(self) -> pg.Rect|None:
+        """
+        Screen area touched by draw(), used by the dirty rectangle renderer.
+        Subclasses overriding draw() must override this too.
+        """
+        return self.renderer.get_rect(self)
         
     def apply_force(self, force: Vec) -> None:
         assert isinstance(force, Vec), f"Attempt to apply non-vector force: type {type(force)}"
         
         force = to_vec3(force)
-        self._forces.append(force)
+        if self._integrator is not None:
+            self._integrator.forces[self._index] += force
+        else:
+            self._forces.append(force)
         return self
 
     def distance(self, other):
@@ -288,6 +352,208 @@ class Actor(Object):
     def get_nomalized_vector_to(self, other):
         return self.get_vector_to(other).normalize()
 
+
+class BoundActor:
+    """
+    Mixed in front of the class of the actors bound to a VectorizedIntegrator.
+    pos, vel, acc, density, friction and gravity_force then live in the integrator
+    arrays and the attributes act as proxies, unbound actors keep plain attributes.
+    Vectors returned by pos/vel/acc are copies : assign them back
+    (e.g. actor.pos += v) instead of mutating their components in place.
+    """
+    _integrator: 'VectorizedIntegrator'
+    _index: int
+    _unbound_class: type
+    
+    @property
+    def pos(self) -> Vec3:
+        integrator = self._integrator
+        if self._pos_generation != integrator.generation:
+            # Cached until the next integration step
+            self._pos = Vec3(*integrator.pos[self._index].tolist())
+            self._pos_generation = integrator.generation
+        return self._pos
+    
+    @pos.setter
+    def pos(self, val: Vec3) -> None:
+        self._integrator.pos[self._index] = val
+        self._pos = val
+    
+    @property
+    def vel(self) -> Vec3:
+        integrator = self._integrator
+        if self._vel_generation != integrator.generation:
+            # Cached until the next integration step
+            self._vel = Vec3(*integrator.vel[self._index].tolist())
+            self._vel_generation = integrator.generation
+        return self._vel
+    
+    @vel.setter
+    def vel(self, val: Vec3) -> None:
+        self._integrator.vel[self._index] = val
+        self._vel = val
+    
+    @property
+    def acc(self) -> Vec3:
+        return Vec3(*self._integrator.acc[self._index].tolist())
+    
+    @acc.setter
+    def acc(self, val: Vec3) -> None:
+        self._integrator.acc[self._index] = val
+    
+    @property
+    def density(self) -> Number:
+        return self._integrator.density.item(self._index)
+    
+    @density.setter
+    def density(self, val: Number) -> None:
+        self._integrator.density[self._index] = val
+    
+    @property
+    def friction(self) -> Number:
+        return self._integrator.friction.item(self._index)
+    
+    @friction.setter
+    def friction(self, val: Number) -> None:
+        self._integrator.friction[self._index] = val
+    
+    @property
+    def gravity_force(self) -> Vec3:
+        return Vec3(*self._integrator.gravity[self._index].tolist())
+    
+    @gravity_force.setter
+    def gravity_force(self, val: Vec3) -> None:
+        self._integrator.gravity[self._index] = val
+    
+    @property
+    def buoyancy_force(self) -> Vec3:
+        """
+        Buoyancy applied by the integrator at the actor position
+        """
+        integrator, i = self._integrator, self._index
+        if integrator.pos[i, 2] > 0:
+            return Vec3()
+        return Vec3(*(-integrator.gravity[i] / integrator.density[i]).tolist())
+
+
+class VectorizedIntegrator:
+    """
+    World level integrator keeping the actors state in contiguous arrays (struct of arrays).
+    Gravity, buoyancy, friction and queued forces are applied to all actors in one step.
+    """
+    _bound_classes: Dict[type, type] = {}     ## Actor class: its BoundActor subclass
+    
+    def __init__(self, capacity: int = 64) -> None:
+        self._actors: List[Actor] = []
+        self.generation = 0             ## Incremented at each step, invalidates the actors cached vectors
+        self._allocate(capacity)
+    
+    def _allocate(self, capacity: int) -> None:
+        n = len(self._actors)
+        def grow(old, shape, fill=0.0):
+            arr = np.full(shape, fill, dtype=np.float64)
+            if old is not None:
+                arr[:n] = old[:n]
+            return arr
+        
+        self.pos = grow(getattr(self, "pos", None), (capacity, 3))
+        self.vel = grow(getattr(self, "vel", None), (capacity, 3))
+        self.acc = grow(getattr(self, "acc", None), (capacity, 3))
+        self.forces = grow(getattr(self, "forces", None), (capacity, 3))
+        self.gravity = grow(getattr(self, "gravity", None), (capacity, 3))
+        self.density = grow(getattr(self, "density", None), (capacity,), 1.0)
+        self.friction = grow(getattr(self, "friction", None), (capacity,))
+        self.capacity = capacity
+    
+    def __len__(self) -> int:
+        return len(self._actors)
+    
+    @classmethod
+    def _bound_class(cls, actor_class: type) -> type:
+        bound = cls._bound_classes.get(actor_class)
+        if bound is None:
+            bound = cls._bound_classes[actor_class] = type(actor_class.__name__, (BoundActor, actor_class), {"_unbound_class": actor_class})
+        return bound
+    
+    def add(self, actor: Actor) -> None:
+        assert actor._integrator is None, "Actor already bound to an integrator"
+        
+        i = len(self._actors)
+        if i >= self.capacity:
+            self._allocate(self.capacity * 2)
+        
+        self.pos[i] = actor.pos
+        self.vel[i] = actor.vel
+        self.acc[i] = actor.acc
+        self.gravity[i] = actor.gravity_force
+        self.density[i] = actor.density
+        self.friction[i] = actor.friction
+        self.forces[i] = 0
+        for f in actor._forces:
+            self.forces[i] += f
+        actor._forces.clear()
+        
+        # The plain attributes are replaced by the array proxies
+        for name in ("pos", "vel", "acc", "density", "friction", "gravity_force", "buoyancy_force"):
+            actor.__dict__.pop(name, None)
+        actor.__class__ = self._bound_class(type(actor))
+        
+        self._actors.append(actor)
+        actor._integrator = self
+        actor._index = i
+        actor._pos_generation = actor._vel_generation = -1
+    
+    def remove(self, actor: Actor) -> None:
+        assert actor._integrator is self, "Actor not bound to this integrator"
+        
+        # Write the state back so the actor stays usable
+        i = actor._index
+        pos, vel, acc = self.pos[i].copy(), self.vel[i].copy(), self.acc[i].copy()
+        density, friction = float(self.density[i]), float(self.friction[i])
+        gravity, buoyancy = actor.gravity_force, actor.buoyancy_force
+        
+        # Swap with the last actor to keep the arrays contiguous
+        last = len(self._actors) - 1
+        if i != last:
+            for arr in (self.pos, self.vel, self.acc, self.forces, self.gravity, self.density, self.friction):
+                arr[i] = arr[last]
+            moved = self._actors[last]
+            self._actors[i] = moved
+            moved._index = i
+        self._actors.pop()
+        
+        actor.__class__ = actor._unbound_class
+        actor._integrator = None
+        actor._index = -1
+        actor.pos, actor.vel, actor.acc = Vec3(*pos), Vec3(*vel), Vec3(*acc)
+        actor.density, actor.friction = density, friction
+        actor.gravity_force, actor.buoyancy_force = gravity, buoyancy
+    
+    def step(self, dt: float) -> None:
+        n = len(self._actors)
+        if n == 0:
+            return
+        
+        pos = self.pos[:n]
+        vel = self.vel[:n]
+        gravity = self.gravity[:n]
+        
+        acc = self.acc[:n]
+        np.add(self.forces[:n], gravity, out=acc)
+        
+        # Buoyancy on water
+        in_water = pos[:, 2] <= 0
+        acc[in_water] -= gravity[in_water] / self.density[:n, None][in_water]
+        
+        acc -= vel * self.friction[:n, None]
+        
+        vel += acc * dt
+        pos += vel * dt
+        
+        self.forces[:n] = 0
+        self.generation += 1
+
+
 class Collision:
     def __init__(self) -> None:
         pass
@@ -320,6 +586,51 @@ class BorderCollision(Collision):
         
 
 
+class SpatialHash:
+    """
+    Uniform grid used as a collision broadphase.
+    Actors are bucketed in every cell covered by their sphere footprint, 
+    so only actors sharing a cell are tested against each other.
+    """
+    def __init__(self, cell_size: Number = Constants.COLLISION_CELL_SIZE) -> None:
+        self.cell_size = cell_size
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+    
+    def clear(self) -> None:
+        self._cells.clear()
+    
+    def insert(self, index: int, pos: Vec, radius: Number) -> None:
+        inv = 1 / self.cell_size
+        x0 = math.floor((pos.x - radius) * inv)
+        x1 = math.floor((pos.x + radius) * inv)
+        y0 = math.floor((pos.y - radius) * inv)
+        y1 = math.floor((pos.y + radius) * inv)
+        cells = self._cells
+        for cx in range(x0, x1+1):
+            for cy in range(y0, y1+1):
+                bucket = cells.get((cx, cy))
+                if bucket is None:
+                    cells[(cx, cy)] = [index]
+                else:
+                    bucket.append(index)
+    
+    def get_pairs(self) -> List[Tuple[int, int]]:
+        """
+        Returns the candidate pairs (i, j) with i < j, sorted, without duplicates
+        """
+        pairs = set()
+        for bucket in self._cells.values():
+            n = len(bucket)
+            if n < 2:
+                continue
+            for k in range(n):
+                i = bucket[k]
+                for l in range(k+1, n):
+                    j = bucket[l]
+                    pairs.add((i, j) if i < j else (j, i))
+        return sorted(pairs)
+
+
 class CollidableActor(Actor):
     """
     Actor with a collision. May or may not interact with other CollisionActor.
@@ -436,7 +747,11 @@ class Ball(CollidableActor):
         return self
         
     def draw(self, screen) -> None:
-        pg.draw.circle(screen, Colors.GREEN, to_vec2(self.pos), self.radius)
+        pg.draw.circle(screen, Colors.GREEN, to_vec2(self.render_pos), self.radius)
+    
+    def get_draw_rect(self) -> pg.Rect|None:
+        pos = self.render_pos
+        return pg.Rect(pos.x - self.radius, pos.y - self.radius, 2*self.radius, 2*self.radius).inflate(2, 2)
     
     def on_collision(self, other, dt):
         self.apply_force(self.kick_multiplier * other.vel.length() * (1/dt) * -self.get_nomalized_vector_to(other))
@@ -450,43 +765,109 @@ class Game:
         
         self.dimensions = self.width, self.height = width, height
         self.fps = 60
+        
+        # Fixed timestep simulation, rendering interpolates between the last two ticks
+        self.fixed_timestep = False
+        self.tick_rate = 120
+        self.max_catch_up = 5           ## Max simulation ticks per rendered frame
+        self.interpolation = 1.0
+        self._accumulator = 0.0
         self._clock = pg.time.Clock()     ## For syncing the FPS
         self._actors: List[Actor] = []
         
-        pg.init()
-        pg.mixer.init()  ## For sound
-
+        self.use_broadphase = True
+        self._broadphase = SpatialHash()
+        self.collision_tests = 0        ## Number of narrowphase tests done last frame
+        self.integrator: VectorizedIntegrator|None = None
+        
+        # Dirty rectangle rendering, only the areas actors left or entered are redrawn
+        self.dirty_rendering = False
+        self.max_dirty_rects = 64       ## Above this, a full redraw is done instead
+        self.max_dirty_area = 0.5       ## Same, as a fraction of the screen area
+        self._draw_rects: Dict[Actor, pg.Rect|None] = {}
+        self._draw_positions: Dict[Actor, Tuple[float, float, float]] = {}   ## Exact render_pos of the last drawn frame
+        self._full_redraw = True
+        
         self.is_fullscreen = False
+        self.headless = False           ## No window, no drawing, no fps throttling
+        self.ticks_per_second = 0.0     ## Measured by step()
         
         mode = 0
         for k,v in flags.items():
             if k == "fullscreen" and v:
                 mode = pg.FULLSCREEN
-             
-        self.screen: pg.Surface = pg.display.set_mode(self.dimensions, mode)
+            if k == "headless" and v:
+                self.headless = True
+            if k == "profile" and v:
+                profiler.enable()
+            if k == "dirty_rects" and v:
+                self.dirty_rendering = True
+            if k == "vectorized_physics" and v:
+                self.integrator = VectorizedIntegrator()
+            if k == "tick_rate" and v:
+                self.fixed_timestep = True
+                self.tick_rate = v
+            if k == "max_catch_up":
+                self.max_catch_up = v
+            if k == "fps":
+                self.fps = v
+        
+        if self.headless:
+            # Must be set before the display is initialized
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+        
+        pg.init()
+        if not self.headless:
+            pg.mixer.init()  ## For sound
+        
+        if self.headless:
+            self.screen: pg.Surface = pg.Surface(self.dimensions)
+        else:
+            self.screen = pg.display.set_mode(self.dimensions, mode)
+            pg.display.set_caption(caption)
         self.alpha_screen = pg.Surface(self.dimensions, pg.SRCALPHA)
-
-        pg.display.set_caption(caption)
         
         self.frame = 0
-        self.prevdt = 1/self.fps
+        self.prevdt = 1/self.fps if self.fps else 0
         
 
     def main(self) -> None:
         # Main game loop.
         self.init()
         
-        dt = 1/self.fps
-        self.prevdt = 1/self.fps
+        if self.headless:
+            # Simulate one second worth of ticks at a time, as fast as possible
+            ticks = round(1/self.timestep)
+            while True:
+                self.step(ticks)
+                profiler.end_frame()
+                print(f"{self.ticks_per_second:.0f} ticks/s")
+        
+        dt = self.timestep
+        self.prevdt = dt
         while True:
-            self.update(dt)
+            if self.fixed_timestep:
+                self.update_fixed(dt)
+            else:
+                self.update(dt)
             self.draw(self.screen)
+            profiler.end_frame()
 
             self.prevdt = dt
             dt = self._clock.tick(self.fps) / 1000
             
+    def preload(self, manifest:AssetManifest) -> AssetPreloader:
+        # Images are decoded on worker threads, then shared by every Image of the same path and size
+        preloader = AssetPreloader(manifest)
+        preloader.on_image = lambda entry, surface: Image._surfaces.__setitem__((entry.path, entry.size), surface)
+        return preloader.start()
+    
     def init(self):
-        self.font = pg.font.Font("./assets/fonts/Nunito-Regular.ttf", 35)
+        assets = self.preload(AssetManifest()
+            .add_font("default", "./assets/fonts/Nunito-Regular.ttf", 35)
+            .add_image("player", "./assets/img/player.png", (64, 64))
+        ).wait()
+        self.font = assets.fonts["default"]
         
         player = Player(self.width/2, self.height/2) \
             .set_collision(SphereCollision(40)) \
@@ -506,6 +887,7 @@ class Game:
             .set_solid(True)
         self.new_actor(ball)
         
+    @profiler.profile("Game.update")
     def update(self, dt:float) -> None:
         for event in pg.event.get():
             if event.type == pg.QUIT:
@@ -522,27 +904,130 @@ class Game:
             # Delete deleted actors
             if a._delete_me:
                 self._actors.pop(i)
+                if a._integrator is not None:
+                    a._integrator.remove(a)
             
             else:
                 a.update(dt)
                 i += 1
+        
+        if self.integrator is not None:
+            self.integrator.step(dt)
                             
 
         self.frame += 1
                 
+    @property
+    def timestep(self) -> float:
+        """
+        Simulated time per update in the windowed loop : the fixed tick with a tick rate,
+        the frame time at the target fps otherwise
+        """
+        if self.fixed_timestep or not self.fps:
+            return 1/self.tick_rate
+        return 1/self.fps
+    
+    def step(self, n:int=1, dt:float|None=None) -> float:
+        """
+        Advances the simulation by n ticks of dt (the windowed loop timestep by default), 
+        as fast as the CPU allows and without drawing.
+        Returns the simulated ticks per second.
+        """
+        if dt is None:
+            dt = self.timestep
+        
+        start = time.perf_counter()
+        for _ in range(n):
+            if self.fixed_timestep:
+                for a in self._actors:
+                    a.save_state()
+            self.update(dt)
+        elapsed = time.perf_counter() - start
+        
+        self.ticks_per_second = n / elapsed if elapsed > 0 else math.inf
+        return self.ticks_per_second
+    
+    def update_fixed(self, frame_time:float) -> int:
+        """
+        Advances the simulation by frame_time using fixed ticks of 1/tick_rate.
+        Leftover time is kept for the next frame and used to interpolate the rendering.
+        Returns the number of ticks simulated.
+        """
+        step = 1/self.tick_rate
+        
+        # Drop the time we can't catch up with instead of spiraling down
+        self._accumulator = min(self._accumulator + frame_time, step * self.max_catch_up)
+        
+        ticks = 0
+        while self._accumulator >= step:
+            for a in self._actors:
+                a.save_state()
+            self.update(step)
+            self._accumulator -= step
+            ticks += 1
+        
+        self.interpolation = self._accumulator / step
+        return ticks
+    
+    @profiler.profile("Game.do_collisions")
     def do_collisions(self, dt:Number):
-        # TODO: This is slow if there are a lot of actors
-        # Could be optimized by segmenting the world into chunks 
+        if not self.use_broadphase:
+            self.do_collisions_brute(dt)
+            return
+        
+        actors = self._actors
+        grid = self._broadphase
+        grid.clear()
+        
+        # Actors that can't be bucketed are tested against everything
+        others = []
+        for i, a in enumerate(actors):
+            if isinstance(a.collision, SphereCollision):
+                grid.insert(i, a.pos, a.collision.radius)
+            else:
+                others.append(i)
+        
+        pairs = grid.get_pairs()
+        if others:
+            extra = set(pairs)
+            for i in others:
+                for j in range(len(actors)):
+                    if i != j:
+                        extra.add((i, j) if i < j else (j, i))
+            pairs = sorted(extra)
+        
+        self.collision_tests = len(pairs)
+        for i, j in pairs:
+            a1 = actors[i]
+            a2 = actors[j]
+            if a1.is_touching(a2):
+                a1.on_collision(a2, dt)
+                a2.on_collision(a1, dt)
+    
+    def do_collisions_brute(self, dt:Number):
+        tests = 0
         for i in range(len(self._actors)):
             for j in range(i+1, len(self._actors)):
                 a1 = self._actors[i]
                 a2 = self._actors[j]
+                tests += 1
                 if a1.is_touching(a2):
                     a1.on_collision(a2, dt)
                     a2.on_collision(a1, dt)
+        self.collision_tests = tests
         
+    @profiler.profile("Game.draw")
     def draw(self, screen) -> None:
-        screen.fill(hex_to_rgb(0x0095e9))
+        if self.headless:
+            return
+        
+        if self.dirty_rendering:
+            self.draw_dirty(screen)
+        else:
+            self.draw_full(screen)
+    
+    def draw_full(self, screen) -> None:
+        screen.fill(Colors.WATER)
         self.alpha_screen.fill((0,0,0,0))
 
         # Draw
@@ -553,10 +1038,63 @@ class Game:
         screen.blit(self.alpha_screen, (0,0))
         pg.display.flip()
     
+    def draw_dirty(self, screen) -> None:
+        rects = {a: a.get_draw_rect() for a in self._actors}
+        positions = {a: tuple(a.render_pos) for a in self._actors}
+        
+        # Areas to redraw: where actors were and where they are now.
+        # Rects are truncated, a sub-pixel move keeps the rect but changes the drawn pixels
+        dirty: List[pg.Rect] = []
+        for a, rect in rects.items():
+            prev = self._draw_rects.get(a)
+            if rect == prev and positions[a] == self._draw_positions.get(a):
+                continue
+            if rect and prev:
+                dirty.append(rect.union(prev))
+            elif rect or prev:
+                dirty.append(rect or prev)
+        for a, prev in self._draw_rects.items():
+            if prev and a not in rects:
+                dirty.append(prev)
+        self._draw_rects = rects
+        self._draw_positions = positions
+        
+        area = sum(r.width * r.height for r in dirty)
+        if self._full_redraw or len(dirty) > self.max_dirty_rects or area > self.max_dirty_area * self.width * self.height:
+            self._full_redraw = False
+            self.draw_full(screen)
+            return
+        
+        if not dirty:
+            return
+        
+        for rect in dirty:
+            self.alpha_screen.set_clip(rect)
+            self.alpha_screen.fill((0,0,0,0))
+            for a in self._actors:
+                r = rects[a]
+                if r and r.colliderect(rect):
+                    a.draw(self.alpha_screen)
+        self.alpha_screen.set_clip(None)
+        
+        for rect in dirty:
+            screen.fill(Colors.WATER, rect)
+            screen.blit(self.alpha_screen, rect, rect)
+        pg.display.update(dirty)
+    
+    def invalidate(self) -> None:
+        """
+        Forces the next dirty rectangle frame to redraw the whole screen
+        """
+        self._full_redraw = True
+    
     def new_actor(self, actor:Actor):
         self._actors.append(actor)
+        if self.integrator is not None:
+            self.integrator.add(actor)
         
 
 
-game = Game("Wow awesome game", 640*2, 480*1.6) 
-game.main()
+if __name__ == "__main__":
+    game = Game("Wow awesome game", 640*2, 480*1.6) 
+    game.main()